@@ -0,0 +1,141 @@
+"""
+In-process stand-in for the dataserver, for the benchmarks.
+
+Files, groups and datasets live in memory and answer the calls the plot
+window makes of their proxies, announcing changes with the same signals the
+real server sends: 'file-added' from the server, 'changed' and 'group-added'
+from groups, and 'resize' and 'attrs-changed' from datasets.
+"""
+import tempfile
+
+import numpy as np
+
+import objectsharer as objsh
+from objectsharer import Shared, remote
+from buffers import GrowableArray
+
+DATA_DIRECTORY = tempfile.gettempdir()
+
+
+class DataSet(Shared):
+    def __init__(self, name, parent, data=None, attrs=None):
+        Shared.__init__(self)
+        self.name = name
+        self.parent = parent
+        self.attrs = dict(attrs or {})
+        self.data = GrowableArray(None if data is None else np.asarray(data))
+
+    @remote
+    def __getitem__(self, index):
+        return np.array(self.data.view()[index])
+
+    @remote
+    def get_attrs(self):
+        return dict(self.attrs)
+
+    @remote
+    def set_attrs(self, **attrs):
+        self.attrs.update(attrs)
+        self.emit('attrs-changed', dict(self.attrs))
+
+    @remote
+    def describe_tree(self):
+        view = self.data.view()
+        return {'attrs': dict(self.attrs), 'shape': view.shape, 'dtype': view.dtype.str}
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def set_data(self, data):
+        self.data.set(np.asarray(data))
+        self.emit('resize', self.data.shape)
+        self.parent.emit('changed', self.name)
+
+    def append(self, rows):
+        self.data.append(np.asarray(rows))
+        self.emit('resize', self.data.shape)
+        self.parent.emit('changed', self.name)
+
+
+class DataGroup(Shared):
+    def __init__(self, name, parent=None, attrs=None):
+        Shared.__init__(self)
+        self.name = name
+        self.parent = parent
+        self.attrs = dict(attrs or {})
+        self.children = {}
+
+    @remote
+    def keys(self):
+        return self.children.keys()
+
+    @remote
+    def __getitem__(self, key):
+        return self.children[key]
+
+    @remote
+    def get_attrs(self):
+        return dict(self.attrs)
+
+    @remote
+    def set_attrs(self, **attrs):
+        self.attrs.update(attrs)
+        self.emit('attrs-changed', dict(self.attrs))
+
+    @remote
+    def describe_tree(self):
+        return {
+            'attrs': dict(self.attrs),
+            'children': dict((k, c.describe_tree()) for k, c in self.children.items()),
+        }
+
+    def create_group(self, name):
+        self.children[name] = DataGroup(name, self)
+        self.emit('group-added', name)
+        return self.children[name]
+
+    def create_dataset(self, name, data=None, attrs=None):
+        self.children[name] = DataSet(name, self, data, attrs)
+        self.emit('changed', name)
+        return self.children[name]
+
+
+class DataServer(Shared):
+    def __init__(self):
+        Shared.__init__(self)
+        self.files = {}
+        objsh.register(self, 'dataserver')
+
+    @remote
+    def hello(self):
+        return 'hello'
+
+    @remote
+    def list_files(self, names_only=True):
+        return self.files.keys() if names_only else dict(self.files)
+
+    @remote
+    def get_file(self, filename):
+        if filename not in self.files:
+            self.files[filename] = DataGroup(filename)
+            self.emit('file-added', filename, self.files[filename])
+        return self.files[filename]
+
+    @remote
+    def remove_file(self, filename):
+        self.files.pop(filename, None)
+
+
+def make_file(server, filename, n_nodes, shape=(100,), group_size=10):
+    """A file holding n_nodes datasets of the given shape, group_size to a group"""
+    f = DataGroup(filename)
+    for i in range(n_nodes):
+        group_name = 'group%d' % (i // group_size)
+        if group_name not in f.children:
+            f.children[group_name] = DataGroup(group_name, f)
+        group = f.children[group_name]
+        name = 'data%d' % i
+        group.children[name] = DataSet(name, group, np.random.normal(size=shape))
+    server.files[filename] = f
+    return f
@@ -0,0 +1,113 @@
+"""
+In-process stand-in for objectsharer, for the benchmarks.
+
+Objects are shared by reference rather than over ZMQ. As with the real
+thing, calls made with a callback= keyword and signals are not delivered
+straight away but from the event loop, through the timer add_qt_timer sets
+up, optionally after a simulated network latency.
+"""
+import time
+import functools
+from collections import deque
+
+from PyQt4 import Qt
+
+DEFAULT_TIMEOUT = 5000
+latency = 0. # Seconds before a reply or signal is delivered
+
+pending = deque() # (due time, function, args)
+
+
+class TimeoutError(Exception):
+    pass
+
+
+def deliver_later(function, *args):
+    pending.append((time.time() + latency, function, args))
+
+
+def process_pending():
+    """Deliver every reply and signal that is due, returning how many there were"""
+    n = 0
+    now = time.time()
+    while pending and pending[0][0] <= now:
+        _, function, args = pending.popleft()
+        function(*args)
+        n += 1
+    return n
+
+
+def remote(method):
+    """Make method callable like a proxied one, answering to callback= from the event loop"""
+    @functools.wraps(method)
+    def call(self, *args, **kwargs):
+        callback = kwargs.pop('callback', None)
+        if callback is None:
+            return method(self, *args, **kwargs)
+        try:
+            result = method(self, *args, **kwargs)
+        except Exception as e:
+            result = e
+        deliver_later(callback, result)
+    return call
+
+
+class Shared(object):
+    """Base for the fake remote objects, with objectsharer style signals"""
+    def __init__(self):
+        self.slots = {}
+
+    def connect(self, signal, function):
+        self.slots.setdefault(signal, []).append(function)
+
+    def emit(self, signal, *args):
+        for function in self.slots.get(signal, []):
+            deliver_later(function, *args)
+
+
+class Helper(object):
+    def __init__(self):
+        self.objects = {}
+
+    def register(self, obj, name=None):
+        """Share obj, giving it connect and emit as the real helper does, unless it has its own"""
+        self.objects[name if name is not None else id(obj)] = obj
+        if not hasattr(obj, 'emit'):
+            signals = Shared()
+            obj.connect = signals.connect
+            obj.emit = signals.emit
+
+    def unregister(self, obj):
+        for name, registered in self.objects.items():
+            if registered is obj:
+                del self.objects[name]
+
+    def find_object(self, name, no_cache=False):
+        if name not in self.objects:
+            raise TimeoutError('No object named ' + name)
+        return self.objects[name]
+
+
+helper = Helper()
+
+
+def register(obj, name=None):
+    helper.register(obj, name)
+
+
+class ZMQBackend(object):
+    poll_interval = 1 # ms
+
+    def __init__(self):
+        self.timer = None
+
+    def start_server(self, addr, port):
+        pass
+
+    def refresh_connection(self, addr):
+        pass
+
+    def add_qt_timer(self):
+        self.timer = Qt.QTimer()
+        self.timer.timeout.connect(process_pending)
+        self.timer.start(self.poll_interval)
@@ -0,0 +1,310 @@
+"""
+Headless benchmarks of the plot window's hot paths.
+
+    python benchmarks/run_benchmarks.py [--quick] [--latency MS] [--output FILE]
+
+The window runs against the in-process stand-ins for objectsharer and the
+dataserver in benchmarks/fakes, under Qt's offscreen platform. Qt 4 builds
+which lack it need a virtual display instead, e.g. xvfb-run. Results are
+written as JSON, to stdout unless --output is given, with the environment
+they were taken in, so runs can be compared from one commit to the next.
+
+Measured are: startup, importing the window and building the tree for files
+of increasing size; append throughput for rank 1 and rank 2 datasets, with
+the memory grown over the run; redraw latency from set_data to the frame
+being on screen; and crosshair hover latency.
+"""
+import os
+import sys
+import gc
+import json
+import time
+import platform
+import argparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(HERE, 'fakes'), os.path.dirname(HERE)]
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+from PyQt4 import Qt
+
+app = Qt.QApplication.instance() or Qt.QApplication([])
+
+import_start = time.time()
+from window import PlotWindow, WindowItem, WindowDataSet, WindowMultiPlot
+import_seconds = time.time() - import_start
+
+import objectsharer as objsh
+import dataserver
+import pyqtgraph as pg
+from profiling import profiler
+
+
+def rss_mb():
+    """Resident memory of this process, in MB"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (IOError, OSError):
+        import resource # Peak rather than current, where /proc isn't there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def timing_stats(samples):
+    samples = np.sort(np.asarray(samples)) * 1e3
+    if len(samples) == 0:
+        return {'count': 0}
+    return {
+        'count': len(samples),
+        'mean_ms': float(samples.mean()),
+        'median_ms': float(np.median(samples)),
+        'p99_ms': float(samples[min(int(.99 * len(samples)), len(samples) - 1)]),
+        'max_ms': float(samples[-1]),
+    }
+
+
+def spin():
+    """One pass of the event loop, including the fake backend's deliveries"""
+    objsh.process_pending()
+    app.processEvents()
+
+
+def busy():
+    if objsh.pending or WindowItem.scheduler.pending:
+        return True
+    return any(item.plot is not None and item.plot.is_preparing()
+               for item in WindowItem.registry.values() if hasattr(item, 'plot'))
+
+
+def settle(timeout=30.):
+    """Run the event loop until every reply, redraw and background frame is done"""
+    deadline = time.time() + timeout
+    while True:
+        spin()
+        if not busy():
+            return
+        if time.time() > deadline:
+            raise RuntimeError('The window did not settle within %s s' % timeout)
+        time.sleep(.0005)
+
+
+def clear_files(server):
+    for key in list(WindowItem.registry):
+        if len(key) == 1 and key in WindowItem.registry:
+            WindowItem.registry[key].remove()
+    server.files.clear()
+    settle()
+    gc.collect()
+
+
+def open_file(win, server, filename):
+    win.add_file(filename, server.files[filename])
+    settle()
+    return WindowItem.registry[(filename,)]
+
+
+def populate_all(group):
+    group.populate(block=True)
+    settle()
+    for child in list(group.child_list):
+        if not child.is_leaf():
+            populate_all(child)
+
+
+def show_dataset(win, path):
+    """Expand the tree down to the dataset at path and plot it"""
+    for depth in range(1, len(path)):
+        WindowItem.registry[path[:depth]].populate(block=True)
+        settle()
+    item = WindowItem.registry[path]
+    win.toggle_item(item, True)
+    settle()
+    return item
+
+
+def bench_startup(win, server, node_counts):
+    results = []
+    for n_nodes in node_counts:
+        clear_files(server)
+        filename = 'startup_%d.h5' % n_nodes
+        dataserver.make_file(server, filename, n_nodes)
+        start = time.time()
+        root = open_file(win, server, filename)
+        add_seconds = time.time() - start
+        WindowDataSet.load = False # As when a file is first listed, nothing is fetched
+        start = time.time()
+        populate_all(root)
+        populate_seconds = time.time() - start
+        WindowDataSet.load = True
+        results.append({
+            'nodes': n_nodes,
+            'add_file_ms': 1e3 * add_seconds,
+            'populate_all_ms': 1e3 * populate_seconds,
+        })
+    clear_files(server)
+    return results
+
+
+def bench_append(win, server, row_shape, n_appends, initial_rows=100):
+    clear_files(server)
+    filename = 'append_%d.h5' % len(row_shape)
+    f = dataserver.make_file(server, filename, 0)
+    group = f.create_group('group0')
+    dset = group.create_dataset('data0', np.random.normal(size=(initial_rows,) + row_shape))
+    open_file(win, server, filename)
+    path = (filename, 'group0', 'data0')
+    item = show_dataset(win, path)
+    if item.plot is None:
+        raise RuntimeError('No plot was made for %s' % '/'.join(path))
+
+    profiler.reset()
+    gc.collect()
+    rss_before = rss_mb()
+    start = time.time()
+    for _ in range(n_appends):
+        dset.append(np.random.normal(size=row_shape))
+        spin()
+    settle()
+    seconds = time.time() - start
+    gc.collect()
+    stages = profiler.summary().get(item.strpath, {})
+    result = {
+        'row_shape': list(row_shape),
+        'appends': n_appends,
+        'appends_per_s': n_appends / seconds,
+        'rows_synced': len(item.buffer),
+        'frames_drawn': stages.get('draw', {}).get('count', 0),
+        'rss_growth_mb': rss_mb() - rss_before,
+    }
+    for stage in ('fetch', 'set_data', 'prepare', 'draw'):
+        if stage in stages:
+            result[stage + '_mean_ms'] = stages[stage]['mean_ms']
+            result[stage + '_max_ms'] = stages[stage]['max_ms']
+    clear_files(server)
+    return result
+
+
+def bench_redraw(win, shape, n_frames):
+    """set_data until the frame is drawn, without waiting on the scheduler's next tick"""
+    name = 'redraw_%s' % 'x'.join(map(str, shape))
+    plot = win.public_interface.add_plot(name)
+    plot.set_data(np.random.normal(size=shape))
+    WindowItem.scheduler.flush()
+    settle()
+    samples = []
+    for _ in range(n_frames):
+        data = np.random.normal(size=shape)
+        start = time.time()
+        plot.set_data(data)
+        WindowItem.scheduler.flush()
+        settle()
+        samples.append(time.time() - start)
+    plot.remove()
+    result = timing_stats(samples)
+    result['shape'] = list(shape)
+    return result
+
+
+def bench_hover(win, n_points, n_moves, parametric=False):
+    """
+    Crosshair lookups at random positions. The parametric trace is a random
+    walk in two dimensions, plotted as a parametric multiplot of its columns,
+    which isn't decimated, so the PointGrid holds every point.
+    """
+    name = 'hover_%d' % n_points
+    if parametric:
+        walk = np.cumsum(np.random.normal(size=(n_points, 2)), axis=0)
+        sources = [win.public_interface.add_plot(name + suffix) for suffix in ('_x', '_y')]
+        for source, column in zip(sources, walk.T):
+            source.set_data(column)
+        shown = WindowMultiPlot(sources, parametric=True)
+    else:
+        sources = [win.public_interface.add_plot(name)]
+        sources[0].set_data(np.cumsum(np.random.normal(size=n_points)))
+        shown = sources[0]
+    WindowItem.scheduler.flush()
+    settle()
+    widget = shown.plot.line_plt
+    widget.add_cross_hair()
+    view_box = widget.getPlotItem().getViewBox()
+    (x_min, x_max), (y_min, y_max) = view_box.viewRange()
+    positions = [view_box.mapViewToScene(pg.Point(x, y)) for x, y in
+                 zip(np.random.uniform(x_min, x_max, n_moves), np.random.uniform(y_min, y_max, n_moves))]
+    widget.handle_mouse_move(positions[0]) # Build anything cached on first use
+    samples = []
+    for pos in positions:
+        start = time.time()
+        widget.handle_mouse_move(pos)
+        samples.append(time.time() - start)
+    widget.hide_cross_hair()
+    if parametric:
+        shown.plot.toggle_hide(show=False)
+        shown.remove()
+    for source in sources:
+        source.remove()
+    settle()
+    result = timing_stats(samples)
+    result.update({'points': n_points, 'parametric': parametric})
+    return result
+
+
+def environment():
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pyqtgraph': pg.__version__,
+        'qt': Qt.QT_VERSION_STR,
+        'qpa_platform': os.environ.get('QT_QPA_PLATFORM'),
+        'latency_ms': 1e3 * objsh.latency,
+    }
+
+
+def run(quick=False):
+    scale = .1 if quick else 1
+    n = lambda count: max(int(count * scale), 1)
+    server = dataserver.DataServer()
+    start = time.time()
+    win = PlotWindow()
+    win.show()
+    settle()
+    window_seconds = time.time() - start
+
+    results = {
+        'startup': {
+            'import_ms': 1e3 * import_seconds,
+            'window_ms': 1e3 * window_seconds,
+            'files': bench_startup(win, server, [n(100), n(1000), n(10000)]),
+        },
+        'append_rank1': bench_append(win, server, (), n(5000)),
+        'append_rank2': bench_append(win, server, (256,), n(2000)),
+        'redraw_rank1': bench_redraw(win, (n(1000000),), n(50)),
+        'redraw_rank2': bench_redraw(win, (512, 512), n(50)),
+        'hover': bench_hover(win, n(1000000), n(2000)),
+        'hover_parametric': bench_hover(win, n(100000), n(2000), parametric=True),
+        'rss_mb': rss_mb(),
+    }
+    win.close()
+    return {'environment': environment(), 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--quick', action='store_true', help='run with a tenth of the work, as a smoke test')
+    parser.add_argument('--latency', type=float, default=0., help='simulated network latency, in ms')
+    parser.add_argument('--output', help='file to write the JSON results to')
+    args = parser.parse_args()
+
+    objsh.latency = args.latency / 1e3
+    report = json.dumps(run(args.quick), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print report
+
+
+if __name__ == '__main__':
+    main()
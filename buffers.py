@@ -0,0 +1,229 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def row_range(index, n_rows):
+    """
+    The (start, stop) range of first-axis rows touched by indexing an array of
+    n_rows rows with index. Anything not understood is taken to touch every row.
+    """
+    if isinstance(index, tuple):
+        if not index:
+            return 0, n_rows
+        index = index[0]
+    if isinstance(index, slice):
+        start, stop, step = index.indices(max(n_rows, index.stop or 0))
+        if step < 0:
+            start, stop = stop + 1, start + 1
+        return start, max(start, stop)
+    if isinstance(index, (int, long, np.integer)):
+        if index < 0:
+            index += n_rows
+        return index, index + 1
+    return 0, n_rows
+
+
+def shift_rows(index, value, offset):
+    """
+    index, and the value to assign there, moved back by offset rows, for an
+    array which dropped its first offset rows since index was worked out. Rows
+    which were dropped are left out, and index is None if none are left. Only
+    integer and unit step slice row indices, counted from the start, are moved.
+    """
+    rest = ()
+    if isinstance(index, tuple):
+        index, rest = index[0], index[1:]
+    if isinstance(index, (int, long, np.integer)) and index >= 0:
+        index -= offset
+        return (None, value) if index < 0 else ((index,) + rest, value)
+    if (isinstance(index, slice) and index.step in (None, 1) and (index.start or 0) >= 0
+            and index.stop is not None and index.stop >= 0):
+        start, stop = (index.start or 0) - offset, index.stop - offset
+        if stop <= 0:
+            return None, value
+        value = np.asarray(value)
+        if start < 0 and value.ndim > len(rest) and len(value) == stop - start:
+            value = value[-start:]
+        return (slice(max(start, 0), stop),) + rest, value
+    raise ValueError('Cannot move the index %s with the rolling window' % (index,))
+
+
+def merge_ranges(a, b):
+    """The union of two (start, stop) row ranges, where None stands for every row"""
+    if a is None or b is None:
+        return None
+    return min(a[0], b[0]), max(a[1], b[1])
+
+
+class GrowableArray(object):
+    """
+    A numpy array which grows along its first axis with amortized O(1) appends.
+
+    Capacity is over-allocated geometrically and the valid rows are handed out
+    as a view of the backing store, so readers never pay for a copy. The dtype
+    is taken from the first data stored, and only widened if incoming rows
+    cannot be represented in it.
+
+    If maxlen is given only the most recent maxlen rows are kept. The store is
+    then a sliding window of twice that size, so the valid region stays
+    contiguous and dropping old rows costs one block move every maxlen appends.
+    """
+    growth = 2
+    min_capacity = 16
+
+    def __init__(self, data=None, maxlen=None):
+        self.maxlen = maxlen
+        self.dropped = 0 # Rows discarded from the front to respect maxlen
+        self._store = None
+        self._start = 0
+        self._stop = 0
+        if data is not None:
+            self.set(data)
+
+    def __len__(self):
+        return self._stop - self._start
+
+    @property
+    def capacity(self):
+        return 0 if self._store is None else len(self._store)
+
+    @property
+    def dtype(self):
+        return None if self._store is None else self._store.dtype
+
+    @property
+    def shape(self):
+        if self._store is None:
+            return (0,)
+        return (len(self),) + self._store.shape[1:]
+
+    def view(self):
+        """The valid rows, as a view of the backing store"""
+        if self._store is None:
+            return np.zeros(0)
+        return self._store[self._start:self._stop]
+
+    def set(self, data):
+        """Replace the contents with data, reusing the store where possible"""
+        data = np.asarray(data)
+        if self.maxlen is not None and len(data) > self.maxlen:
+            data = data[-self.maxlen:]
+        if (self._store is None or self._store.dtype != data.dtype or
+                self._store.shape[1:] != data.shape[1:] or self.capacity < len(data)):
+            self._store = self._allocate(len(data), data.shape[1:], data.dtype)
+        self._start, self._stop = 0, len(data)
+        self._store[:len(data)] = data
+        self.dropped = 0
+
+    def append(self, rows):
+        """
+        Append rows to the end of the array. rows is either one row (shaped like
+        the trailing dimensions) or a stack of them. Appending to an empty array
+        takes anything but a scalar as a stack of rows.
+        """
+        rows = np.asarray(rows)
+        if self._store is None:
+            self.set(rows if rows.ndim > 0 else rows.reshape(1))
+            return
+        if rows.ndim < self._store.ndim:
+            rows = rows.reshape((1,) + rows.shape)
+        if rows.shape[1:] != self._store.shape[1:]:
+            raise ValueError('Cannot append rows of shape %s to array of shape %s' %
+                             (rows.shape[1:], self.shape))
+        self._promote(rows.dtype)
+        if self.maxlen is not None and len(rows) > self.maxlen:
+            self.dropped += len(self) + len(rows) - self.maxlen
+            self._start = self._stop
+            rows = rows[-self.maxlen:]
+        self._make_room(len(rows))
+        self._store[self._stop:self._stop+len(rows)] = rows
+        self._stop += len(rows)
+
+    def resize(self, n_rows):
+        """Grow or shrink to n_rows rows. New rows are zero filled."""
+        if n_rows <= len(self):
+            self._stop = self._start + n_rows
+            return
+        n_new = n_rows - len(self)
+        self._make_room(n_new)
+        self._store[self._stop:self._stop+n_new] = 0
+        self._stop += n_new
+
+    def reserve(self, n_rows):
+        """Ensure there is room for n_rows rows without reallocating"""
+        if self._store is not None and self._start + n_rows > self.capacity:
+            self._reallocate(n_rows)
+
+    def __getitem__(self, index):
+        return self.view()[index]
+
+    def __setitem__(self, index, value):
+        value = np.asarray(value)
+        self._promote(np.min_scalar_type(value) if value.ndim == 0 else value.dtype)
+        self.view()[index] = value
+
+    def _allocate(self, n_rows, trailing_shape, dtype):
+        capacity = max(self.growth * n_rows, self.min_capacity)
+        if self.maxlen is not None:
+            capacity = min(capacity, 2 * self.maxlen)
+        return np.zeros((capacity,) + tuple(trailing_shape), dtype=dtype)
+
+    def _reallocate(self, n_rows, dtype=None):
+        store = self._allocate(n_rows, self._store.shape[1:], dtype or self._store.dtype)
+        n = len(self)
+        store[:n] = self._store[self._start:self._stop]
+        self._store, self._start, self._stop = store, 0, n
+
+    def _make_room(self, n_new):
+        """Make space for n_new rows past the end, dropping old ones if over maxlen"""
+        if self.maxlen is not None and len(self) + n_new > self.maxlen:
+            drop = len(self) + n_new - self.maxlen
+            self._start += drop
+            self.dropped += drop
+        if self._stop + n_new <= self.capacity:
+            return
+        n = len(self)
+        if n + n_new <= self.capacity // 2:
+            # Plenty of space ahead of the valid region, slide it back to the start
+            self._store[:n] = self._store[self._start:self._stop]
+            self._start, self._stop = 0, n
+        else:
+            self._reallocate(n + n_new)
+
+    def _promote(self, dtype):
+        if self._store is not None and not np.can_cast(dtype, self._store.dtype):
+            self._reallocate(len(self), np.result_type(self._store.dtype, dtype))
+
+
+class AxisCache(object):
+    """
+    Evenly spaced axes, x0 + xscale*arange(n), shared by everyone drawing
+    against the same x0 and xscale.
+
+    Each axis is held in a GrowableArray, so when a trace grows by appending
+    only the new points are computed, and callers are handed read-only views
+    of the same memory rather than arrays of their own. The least recently
+    used axes are dropped past max_axes.
+    """
+    max_axes = 64
+
+    def __init__(self):
+        self.axes = OrderedDict() # (x0, xscale) -> GrowableArray
+        self.lock = threading.Lock() # Plots are prepared on worker threads
+
+    def get(self, x0, xscale, n):
+        key = (x0, xscale)
+        with self.lock:
+            axis = self.axes.pop(key, None)
+            if axis is None:
+                axis = GrowableArray(np.zeros(0))
+            self.axes[key] = axis
+            while len(self.axes) > self.max_axes:
+                self.axes.popitem(last=False)
+            if len(axis) < n:
+                axis.append(x0 + xscale*np.arange(len(axis), n, dtype=float))
+            view = axis[:n]
+        view.flags.writeable = False
+        return view
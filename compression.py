@@ -0,0 +1,81 @@
+import zlib
+
+import numpy as np
+
+try:
+    import blosc
+except ImportError:
+    blosc = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+def available_codecs():
+    codecs = ['zlib']
+    if lz4_frame is not None:
+        codecs.insert(0, 'lz4')
+    if blosc is not None:
+        codecs.insert(0, 'blosc')
+    return codecs
+
+
+def fastest_codec():
+    """The quickest codec installed, or None if only zlib is, which isn't worth it on a fast link"""
+    codec = available_codecs()[0]
+    return None if codec == 'zlib' else codec
+
+
+def encode_array(a, codec=None, delta=False):
+    """
+    A picklable dict holding a, compressed with codec if given. With delta,
+    integer arrays are sent as differences between successive rows, which
+    compress far better for slowly varying counts. Floats are never delta
+    encoded, as summing them back up would not be exact.
+    """
+    a = np.ascontiguousarray(a)
+    delta = delta and a.dtype.kind in 'iu' and a.ndim > 0
+    if delta:
+        diffs = a.copy()
+        diffs[1:] -= a[:-1]
+        a = diffs
+    raw = a.tobytes()
+    if codec == 'blosc':
+        raw = blosc.compress(raw, typesize=a.dtype.itemsize, cname='lz4', shuffle=blosc.SHUFFLE)
+    elif codec == 'lz4':
+        raw = lz4_frame.compress(raw)
+    elif codec == 'zlib':
+        raw = zlib.compress(raw, 1)
+    elif codec is not None:
+        raise ValueError('Unknown codec ' + str(codec))
+    return {
+        'encoded_array': raw,
+        'codec': codec,
+        'delta': delta,
+        'dtype': a.dtype.str,
+        'shape': a.shape,
+    }
+
+
+def is_encoded(obj):
+    return isinstance(obj, dict) and 'encoded_array' in obj
+
+
+def decode_array(payload):
+    raw, codec = payload['encoded_array'], payload['codec']
+    if codec == 'blosc':
+        if blosc is None:
+            raise ImportError('blosc is needed to decode this data')
+        raw = blosc.decompress(raw)
+    elif codec == 'lz4':
+        if lz4_frame is None:
+            raise ImportError('lz4 is needed to decode this data')
+        raw = lz4_frame.decompress(raw)
+    elif codec == 'zlib':
+        raw = zlib.decompress(raw)
+    a = np.frombuffer(raw, dtype=np.dtype(payload['dtype'])).reshape(payload['shape'])
+    if payload['delta']:
+        a = np.cumsum(a, axis=0, dtype=a.dtype)
+    return a
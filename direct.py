@@ -0,0 +1,77 @@
+import os
+import logging
+
+import numpy as np
+
+logger = logging.getLogger("Direct Reads")
+
+
+def is_under(filename, directory):
+    """Whether filename lies somewhere inside directory"""
+    directory = os.path.join(os.path.realpath(directory), '')
+    return os.path.realpath(filename).startswith(directory)
+
+
+class DirectFile(object):
+    """
+    Read-only access to a local HDF5 file, bypassing the dataserver.
+
+    The file is opened in SWMR read mode where h5py and the file support it,
+    so that datasets being written by the dataserver can be refreshed and
+    read consistently. Contiguous, unfiltered datasets are memory mapped
+    instead, which makes a read of a slice a copy out of the page cache.
+    Without SWMR only those can be trusted to be current, and read returns
+    None for anything else so the caller can go through the server.
+    """
+    def __init__(self, filename):
+        try:
+            import h5py # Only needed once direct reads are turned on, and slow to load
+        except ImportError:
+            raise IOError('h5py is needed to read %s directly' % filename)
+        self.filename = filename
+        self.swmr = False
+        try:
+            self.file = h5py.File(filename, 'r', libver='latest', swmr=True)
+            self.swmr = True
+        except (TypeError, ValueError, IOError):
+            # Old h5py, or a file not written for SWMR
+            self.file = h5py.File(filename, 'r')
+        self.memmaps = {}
+
+    def memmap(self, path):
+        """A memory map of the dataset at path, or None if it is not laid out contiguously"""
+        if path not in self.memmaps:
+            dset = self.file[path]
+            offset = dset.id.get_offset()
+            if (dset.chunks is not None or dset.compression is not None or offset is None
+                    or dset.dtype.hasobject or dset.size == 0):
+                self.memmaps[path] = None
+            else:
+                self.memmaps[path] = np.memmap(self.filename, dtype=dset.dtype, mode='r',
+                                               offset=offset, shape=dset.shape)
+        return self.memmaps[path]
+
+    def forget(self, path):
+        """Drop the map of the dataset at path, for when it may have been recreated"""
+        self.memmaps.pop('/'.join(path), None)
+
+    def read(self, path, index):
+        """dataset[index] for the dataset at path, or None if it can't be read directly"""
+        path = '/'.join(path)
+        try:
+            mapped = self.memmap(path)
+            if mapped is not None:
+                return np.array(mapped[index])
+            if self.swmr:
+                dset = self.file[path]
+                dset.refresh()
+                return dset[index]
+        except (KeyError, IOError, ValueError):
+            # Not written to disk yet, or the layout changed under us
+            logger.debug('Falling back to the dataserver for %s' % path)
+            self.memmaps.pop(path, None)
+        return None
+
+    def close(self):
+        self.memmaps = {}
+        self.file.close()
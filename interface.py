@@ -1,7 +1,152 @@
+import time
+import logging
+
+import numpy as np
 import objectsharer as objsh
 
+from shm import SharedArray
+from compression import encode_array, fastest_codec
+
+logger = logging.getLogger("Plot Client")
+
 def plotwindow_client(serveraddr='127.0.0.1', serverport=55557, localaddr='127.0.0.1'):
     zbe = objsh.ZMQBackend()
     zbe.start_server(addr=localaddr)
     zbe.refresh_connection('tcp://%s:%d' % (serveraddr, serverport))     # Data server
     return objsh.helper.find_object('plotwin')
+
+
+class SharedMemoryPlot(object):
+    """
+    Sends data to a plot in a window on the same host through shared memory.
+
+    Each set_data copies the array once into a shm.SharedArray and only sends
+    its handle, which the window maps and copies the rows in use out of as
+    it receives it. Updates go to two buffers in turn, so a mapping the
+    window is still reading from isn't written over. Buffers are
+    allocated with room for growth rows times the data's, and the handle says
+    how many are in use, so a growing trace keeps its buffers, and the window
+    its mappings, until they fill up.
+
+        plotwin = plotwindow_client()
+        plot = SharedMemoryPlot(plotwin.add_plot('trace'))
+        plot.set_data(data)
+    """
+    growth = 2
+    min_rows = 16
+
+    def __init__(self, plot):
+        self.plot = plot
+        self.buffers = [None, None]
+        self.current = 0
+
+    def set_data(self, data, changed=None):
+        data = np.asarray(data)
+        if data.ndim == 0 or data.size == 0: # Nothing worth mapping
+            self.plot.set_data(data, changed)
+            return
+        self.current = 1 - self.current
+        old = buffer = self.buffers[self.current]
+        if (buffer is None or buffer.array.shape[1:] != data.shape[1:]
+                or buffer.array.dtype != data.dtype or len(buffer.array) < len(data)):
+            rows = max(self.growth * len(data), self.min_rows)
+            buffer = self.buffers[self.current] = SharedArray((rows,) + data.shape[1:], data.dtype)
+        buffer.array[:len(data)] = data
+        self.plot.set_shared_data(buffer.handle(rows=len(data)), changed)
+        if old is not buffer and old is not None: # The window has mapped the new buffer by now
+            old.close()
+
+    def close(self):
+        for buffer in self.buffers:
+            if buffer is not None:
+                buffer.close()
+        self.buffers = [None, None]
+
+
+class BatchingClient(object):
+    """
+    Queues plot calls and sends them to the window in batches, one message
+    per batch, for producers on the other end of a slow link.
+
+    A batch goes out with the first call queued after its oldest call has
+    waited max_delay seconds, or once it holds max_bytes of array data, or on
+    flush(). Everything is sent from the producer's thread, as the connection
+    isn't safe to share, so a producer which stops queueing calls must call
+    flush() for the last of them to be sent. Sending doesn't wait for the
+    reply, unless max_in_flight batches are already unanswered. Arrays over
+    compress_above bytes are compressed with codec, by default the fastest of
+    blosc and lz4 installed, and with delta integer arrays are sent as row
+    differences. Calls replacing a plot's data drop the calls queued before
+    them for that plot.
+
+        client = BatchingClient(plotwindow_client())
+        for rows in acquisition:
+            client.append_data('trace', rows)
+        client.flush()
+    """
+    data_methods = ('set_data', 'append_data', 'set_data_slice')
+
+    def __init__(self, plotwin, max_delay=.05, max_bytes=1<<20, codec='auto', delta=False,
+                 compress_above=1<<16, max_in_flight=4):
+        self.plotwin = plotwin
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self.codec = fastest_codec() if codec == 'auto' else codec
+        self.delta = delta
+        self.compress_above = compress_above
+        self.max_in_flight = max_in_flight
+        self.calls = [] # (name, method, args)
+        self.n_bytes = 0
+        self.first_queued = None
+        self.in_flight = 0
+
+    def set_data(self, name, data):
+        self.queue(name, 'set_data', np.asarray(data))
+
+    def append_data(self, name, rows):
+        self.queue(name, 'append_data', np.asarray(rows))
+
+    def set_data_slice(self, name, index, value):
+        self.queue(name, 'set_data_slice', index, np.asarray(value))
+
+    def set_rolling_window(self, name, n_rows=None):
+        self.queue(name, 'set_rolling_window', n_rows)
+
+    def queue(self, name, method, *args):
+        if method == 'set_data':
+            replaced = lambda c: c[0] == name and c[1] in self.data_methods
+            self.n_bytes -= sum(self.call_bytes(c[2]) for c in self.calls if replaced(c))
+            self.calls = [c for c in self.calls if not replaced(c)]
+        self.calls.append((name, method, args))
+        self.n_bytes += self.call_bytes(args)
+        if self.first_queued is None:
+            self.first_queued = time.time()
+        if self.n_bytes >= self.max_bytes or time.time() - self.first_queued >= self.max_delay:
+            self.flush()
+
+    def call_bytes(self, args):
+        return sum(a.nbytes for a in args if isinstance(a, np.ndarray))
+
+    def encode(self, arg):
+        if not isinstance(arg, np.ndarray):
+            return arg
+        if arg.nbytes > self.compress_above and (self.codec is not None or self.delta):
+            return encode_array(arg, self.codec, self.delta)
+        return arg
+
+    def flush(self):
+        """Send everything queued"""
+        if not self.calls:
+            return
+        batch = [(name, method, [self.encode(a) for a in args]) for name, method, args in self.calls]
+        self.calls, self.n_bytes, self.first_queued = [], 0, None
+        if self.in_flight >= self.max_in_flight:
+            self.plotwin.apply_batch(batch) # Wait, rather than pile up unsent batches
+        else:
+            self.in_flight += 1
+            self.plotwin.apply_batch(batch, callback=self.batch_applied)
+
+    def batch_applied(self, result):
+        self.in_flight -= 1
+        if isinstance(result, Exception):
+            logger.warning('Plot window failed to apply a batch: %s' % result)
@@ -0,0 +1,61 @@
+import warnings
+
+import numpy as np
+
+
+class RunningLevels(object):
+    """
+    Display levels for an image which are updated from its changed rows only.
+
+    Keeps the running min and max, and a uniform reservoir sample of the values
+    seen from which percentile levels can be read off cheaply. Rows which are
+    overwritten can only widen the min/max, a full update (changed=None) starts
+    over.
+    """
+    sample_size = 4096
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.min = None
+        self.max = None
+        self.n_seen = 0
+        self.sample = np.zeros(self.sample_size)
+
+    def update(self, data, changed=None):
+        if changed is None or self.min is None:
+            self.reset()
+            rows = data
+        else:
+            rows = data[changed[0]:changed[1]]
+        values = np.asarray(rows).ravel()
+        if not len(values):
+            return
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) # All-NaN rows
+            lo, hi = np.nanmin(values), np.nanmax(values)
+        if not np.isnan(lo):
+            self.min = lo if self.min is None else min(self.min, lo)
+            self.max = hi if self.max is None else max(self.max, hi)
+
+        # Reservoir sampling, value i is kept with probability size/(n_seen+i+1)
+        seen = self.n_seen + np.arange(len(values))
+        slots = np.where(seen < self.sample_size, seen,
+                         (np.random.random(len(values)) * (seen + 1)).astype(int))
+        kept = slots < self.sample_size
+        self.sample[slots[kept]] = values[kept]
+        self.n_seen += len(values)
+
+    def levels(self, percentile=None):
+        """
+        (low, high) levels, the full range or, given a percentile, that far in
+        from either end of the distribution. None before any finite data.
+        """
+        if self.min is None:
+            return None
+        if not percentile:
+            return self.min, self.max
+        sample = self.sample[:min(self.n_seen, self.sample_size)]
+        return tuple(np.nanpercentile(sample, [percentile, 100 - percentile]))
@@ -0,0 +1,215 @@
+import numpy as np
+
+from buffers import GrowableArray
+
+
+class MinMaxPyramid(object):
+    """
+    Min/max envelopes of a 1D trace over blocks of 2, 4, 8, ... samples.
+
+    Drawing the envelope at roughly one block per pixel looks the same as
+    drawing every sample, peaks included, at a fraction of the cost. The
+    pyramid is about the size of the trace itself, and after an append only
+    the blocks covering the new samples are recomputed.
+    """
+    def __init__(self):
+        self.y = None
+        self.levels = [] # levels[k] holds (min, max) rows over blocks of 2**(k+1)
+
+    def __len__(self):
+        return 0 if self.y is None else len(self.y)
+
+    def update(self, y, changed=None):
+        """
+        Take y as the new trace. If changed, the (start, stop) range of samples
+        modified since the last update, is given only those blocks are redone.
+        """
+        y = np.asarray(y)
+        if changed is None or self.y is None or len(y) < len(self.y):
+            start = 0
+            self.levels = []
+        else:
+            start = changed[0]
+        self.y = y
+
+        lows, highs = y, y
+        k = 0
+        while len(lows) > 1:
+            start //= 2
+            n_blocks = (len(lows) + 1) // 2
+            if k == len(self.levels):
+                self.levels.append(GrowableArray(np.zeros((0, 2), dtype=y.dtype)))
+            level = self.levels[k]
+            level.resize(n_blocks)
+            edges = np.arange(2*start, len(lows), 2)
+            if len(edges):
+                level[start:, 0] = np.minimum.reduceat(lows[2*start:], edges - 2*start)
+                level[start:, 1] = np.maximum.reduceat(highs[2*start:], edges - 2*start)
+            lows, highs = level.view()[:, 0], level.view()[:, 1]
+            k += 1
+        del self.levels[k:]
+
+    def envelope(self, start, stop, n_bins):
+        """
+        Sample positions and values tracing y[start:stop] with about n_bins
+        min/max pairs, or the samples themselves if there are few enough.
+        """
+        per_bin = (stop - start) / float(max(n_bins, 1))
+        k = int(np.floor(np.log2(per_bin))) - 1 if per_bin >= 2 else -1
+        k = min(k, len(self.levels) - 1)
+        if k < 0:
+            return np.arange(start, stop), self.y[start:stop]
+        size = 2 ** (k + 1)
+        first, last = start // size, -(-stop // size)
+        blocks = self.levels[k][first:last]
+        positions = np.repeat(np.arange(first, last) * size + (size - 1) / 2., 2)
+        # Blocks can straddle the ends, keep positions in order with neighbours
+        return np.clip(positions, start, stop - 1), blocks.ravel()
+
+    def viewport(self, start, stop, n_bins, n_context_bins=256):
+        """
+        Like envelope for the visible samples start:stop, with a coarse envelope
+        of the rest of the trace on either side so the full extent is kept.
+        """
+        n = len(self)
+        start, stop = max(0, min(start, n)), max(0, min(stop, n))
+        parts = [self.envelope(start, stop, n_bins)]
+        if start > 0:
+            parts.insert(0, self.envelope(0, start, n_context_bins))
+        if stop < n:
+            parts.append(self.envelope(stop, n, n_context_bins))
+        return (np.concatenate([p[0] for p in parts]),
+                np.concatenate([p[1] for p in parts]))
+
+
+class ImagePyramid(object):
+    """
+    Mipmaps of a 2D image, each level the 2x2 block means of the one before.
+
+    Only the level matching the screen resolution, cropped to the visible
+    region, needs to be handed to an ImageItem, which bounds the cost of
+    levelling and uploading by the size of the view rather than the data.
+    Rows written since the last update are propagated up through the levels
+    without touching the rest.
+    """
+    def __init__(self):
+        self.levels = [] # levels[0] is the image itself, the rest GrowableArrays
+
+    @property
+    def shape(self):
+        return self.levels[0].shape if self.levels else (0, 0)
+
+    def update(self, data, changed=None):
+        """
+        Take data as the new image. If changed, the (start, stop) range of rows
+        modified since the last update, is given only those rows are redone.
+        """
+        data = np.asarray(data)
+        if (changed is None or not self.levels or data.shape[1:] != self.shape[1:]
+                or len(data) < self.shape[0]):
+            start, stop = 0, len(data)
+            del self.levels[1:]
+        else:
+            start, stop = changed
+            if len(data) > self.shape[0]:
+                start, stop = min(start, self.shape[0]), len(data)
+        self.levels[:1] = [data]
+        dtype = np.promote_types(data.dtype, np.float32)
+
+        src = data
+        k = 1
+        while min(src.shape) > 1:
+            start, stop = start // 2, -(-stop // 2)
+            n_rows, n_cols = -(-src.shape[0] // 2), -(-src.shape[1] // 2)
+            if k == len(self.levels):
+                self.levels.append(GrowableArray(np.zeros((0, n_cols), dtype=dtype)))
+            level = self.levels[k]
+            level.resize(n_rows)
+            stop = min(stop, n_rows)
+            if stop > start:
+                level[start:stop] = block_means(src[2*start:2*stop], dtype)
+            src = level.view()
+            k += 1
+        del self.levels[k:]
+
+    def region(self, rows, cols, n_row_pixels, n_col_pixels):
+        """
+        The coarsest level which still has a sample per screen pixel over the
+        (start, stop) index ranges rows and cols, cropped to them. Returns the
+        crop, the full resolution index of its first pixel and its block size.
+        """
+        per_pixel = min((rows[1] - rows[0]) / float(max(n_row_pixels, 1)),
+                        (cols[1] - cols[0]) / float(max(n_col_pixels, 1)))
+        k = int(np.floor(np.log2(per_pixel))) if per_pixel >= 1 else 0
+        k = max(0, min(k, len(self.levels) - 1))
+        step = 2 ** k
+        level = self.levels[k]
+        level = level.view() if k else level
+        r0 = max(int(np.floor(rows[0] / float(step))) - 1, 0)
+        r1 = min(int(np.ceil(rows[1] / float(step))) + 1, level.shape[0])
+        c0 = max(int(np.floor(cols[0] / float(step))) - 1, 0)
+        c1 = min(int(np.ceil(cols[1] / float(step))) + 1, level.shape[1])
+        return level[r0:max(r0, r1), c0:max(c0, c1)], (r0*step, c0*step), step
+
+
+def block_means(a, dtype=np.float64):
+    """Means over 2x2 blocks of a, where blocks on an odd edge hold fewer samples"""
+    row_edges = np.arange(0, a.shape[0], 2)
+    col_edges = np.arange(0, a.shape[1], 2)
+    sums = np.add.reduceat(np.add.reduceat(a, row_edges, axis=0, dtype=np.float64),
+                           col_edges, axis=1)
+    counts = np.outer(np.diff(np.append(row_edges, a.shape[0])),
+                      np.diff(np.append(col_edges, a.shape[1])))
+    return (sums / counts).astype(dtype)
+
+
+class SurfaceGrid(object):
+    """
+    A decimated copy of an image, for drawing as a surface with at most
+    max_vertices vertices.
+
+    Rows are allocated ahead of the data, for expected_rows if it is known and
+    otherwise doubling as the image grows, so that an accumulating image keeps
+    the same mesh and only the heights of changed rows need writing. Rows not
+    filled in yet are flat at zero.
+    """
+    def __init__(self, max_vertices=256*256):
+        self.max_vertices = max_vertices
+        self.z = None
+        self.n_rows = 0 # Image rows sampled so far
+        self.row_step = self.col_step = 1
+        self.expected_rows = None # As given when the grid was last allocated
+
+    def update(self, data, changed=None, expected_rows=None):
+        """
+        Sample the rows of data in the (start, stop) range changed, or all of
+        them. Returns True if the grid was reallocated, so its shape and
+        coordinates changed.
+        """
+        n_rows, n_cols = data.shape
+        capacity = self.z.shape[0] * self.row_step if self.z is not None else 0
+        reallocate = (self.z is None or n_cols != self.n_cols or n_rows > capacity
+                      or n_rows < self.n_rows)
+        if reallocate:
+            capacity = max(expected_rows or 0, n_rows if self.z is None else 2*n_rows, 1)
+            self.expected_rows = expected_rows
+            self.n_cols = n_cols
+            self.col_step = max(1, int(np.ceil(n_cols / np.sqrt(self.max_vertices))))
+            grid_cols = -(-n_cols // self.col_step)
+            self.row_step = max(1, int(np.ceil(capacity * grid_cols / float(self.max_vertices))))
+            self.z = np.zeros((-(-capacity // self.row_step), grid_cols),
+                              dtype=np.promote_types(data.dtype, np.float32))
+            changed = None
+        start, stop = (0, n_rows) if changed is None else changed
+        first, last = start // self.row_step, -(-min(stop, n_rows) // self.row_step)
+        if last > first:
+            self.z[first:last] = data[first*self.row_step:last*self.row_step:self.row_step,
+                                      ::self.col_step]
+        self.n_rows = n_rows
+        return reallocate
+
+    def coords(self, x0, y0, xscale, yscale):
+        """The x and y coordinates of the grid's rows and columns"""
+        xs = x0 + xscale*self.row_step*np.arange(self.z.shape[0])
+        ys = y0 + yscale*self.col_step*np.arange(self.z.shape[1])
+        return xs, ys
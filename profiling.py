@@ -0,0 +1,88 @@
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+
+class StageStats(object):
+    """Timings of one stage for one path"""
+    bucket_ms = [.1, .3, 1, 3, 10, 30, 100, 300, 1000, 3000, float('inf')] # Histogram upper edges
+    rate_window = 5. # Seconds over which the rate is measured
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self.n_bytes = 0
+        self.histogram = [0] * len(self.bucket_ms)
+        self.recent = deque() # Times of the events within rate_window
+
+    def add(self, seconds, n_bytes, now):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.n_bytes += n_bytes
+        self.histogram[bisect_left(self.bucket_ms, seconds * 1e3)] += 1
+        self.recent.append(now)
+        self.expire(now)
+
+    def expire(self, now):
+        while self.recent and self.recent[0] < now - self.rate_window:
+            self.recent.popleft()
+
+    def summary(self, now):
+        self.expire(now)
+        return {
+            'count': self.count,
+            'rate': len(self.recent) / self.rate_window,
+            'mean_ms': 1e3 * self.total / self.count if self.count else 0.,
+            'max_ms': 1e3 * self.max,
+            'bytes': self.n_bytes,
+            'histogram': zip(self.bucket_ms, self.histogram),
+        }
+
+
+class Profiler(object):
+    """
+    Latency histograms, bytes and rates of the window's hot paths, per
+    dataset path and stage: 'fetch', 'resize', 'set_data', 'update_plot',
+    'prepare', 'draw' and 'tree'. Stages may be recorded from any thread.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = True
+        self.stats = {} # (path, stage) -> StageStats
+
+    def record(self, path, stage, seconds, n_bytes=0):
+        if not self.enabled:
+            return
+        with self.lock:
+            key = (path, stage)
+            if key not in self.stats:
+                self.stats[key] = StageStats()
+            self.stats[key].add(seconds, n_bytes, time.time())
+
+    @contextmanager
+    def timed(self, path, stage, n_bytes=0):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(path, stage, time.time() - start, n_bytes)
+
+    def summary(self):
+        """{path: {stage: stats}}, with stats as StageStats.summary gives them"""
+        now = time.time()
+        result = {}
+        with self.lock:
+            for (path, stage), stats in self.stats.items():
+                result.setdefault(path, {})[stage] = stats.summary(now)
+        return result
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+
+profiler = Profiler()
@@ -0,0 +1,84 @@
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+# /dev/shm is memory backed where it exists, so mapped files there never touch disk
+SHM_DIRECTORY = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+class SharedArray(object):
+    """
+    An array in a memory mapped file which another process on the same host
+    can map by handle, rather than have the data pickled across a socket.
+
+    The handle is a small dict of the file's path, the shape and the dtype,
+    which objectsharer can pass around cheaply. It may also give the number
+    of rows in use, for arrays allocated with room to grow. The file is
+    unlinked when the creating side closes it, mappings already made
+    elsewhere stay valid.
+    """
+    prefix = 'h5plot-'
+
+    def __init__(self, shape, dtype, path=None):
+        self.owner = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix=self.prefix, dir=SHM_DIRECTORY)
+            os.close(fd)
+        self.path = path
+        self.array = np.memmap(path, dtype=dtype, shape=tuple(shape),
+                               mode='w+' if self.owner else 'r')
+
+    @classmethod
+    def attach(cls, handle):
+        """Map the array described by handle, read only"""
+        return cls(handle['shape'], np.dtype(handle['dtype']), path=handle['shm_path'])
+
+    def handle(self, rows=None):
+        handle = {
+            'shm_path': self.path,
+            'shape': self.array.shape,
+            'dtype': self.array.dtype.str,
+        }
+        if rows is not None:
+            handle['rows'] = rows
+        return handle
+
+    def matches(self, handle):
+        return (handle['shm_path'] == self.path and tuple(handle['shape']) == self.array.shape
+                and np.dtype(handle['dtype']) == self.array.dtype)
+
+    def close(self):
+        self.array = None
+        if self.owner and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def is_handle(obj):
+    return isinstance(obj, dict) and 'shm_path' in obj
+
+
+class SharedArrayCache(object):
+    """
+    Keeps the mappings for the most recent handles seen, so that a sender
+    rewriting the same buffers, or alternating between a pair of them, is not
+    remapped on every update.
+    """
+    max_mapped = 4
+
+    def __init__(self):
+        self.shared = OrderedDict() # shm_path -> SharedArray, least recently used first
+
+    def resolve(self, obj):
+        """The array behind obj if it is a handle, otherwise obj as an array"""
+        if not is_handle(obj):
+            return np.asarray(obj)
+        shared = self.shared.pop(obj['shm_path'], None)
+        if shared is None or not shared.matches(obj):
+            shared = SharedArray.attach(obj)
+        self.shared[obj['shm_path']] = shared
+        while len(self.shared) > self.max_mapped:
+            self.shared.popitem(last=False)
+        rows = obj.get('rows')
+        return shared.array if rows is None else shared.array[:rows]
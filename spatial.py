@@ -0,0 +1,119 @@
+import numpy as np
+
+
+class PointGrid(object):
+    """
+    A uniform grid of square cells over a set of 2D points, for nearest point
+    queries.
+
+    Points are bucketed into cells with a single argsort, and a query looks
+    through rings of cells around its own until no unvisited cell can be
+    closer than the best point found so far. Building is O(n log n), a query
+    near the points typically only touches a handful of cells. Appending m
+    points with extend is O(n + m log m) while they land inside the grid.
+    """
+    points_per_cell = 4
+    margin = .5 # Room left around the points when the grid is laid out again, in spans
+
+    def __init__(self, x, y):
+        self.x = np.array(x, dtype=float)
+        self.y = np.array(y, dtype=float)
+        self.lay_out()
+
+    def lay_out(self, margin=0):
+        """Bucket every point, with the grid reaching margin times their span past them"""
+        valid = np.flatnonzero(np.isfinite(self.x) & np.isfinite(self.y))
+        if len(valid):
+            self.x_min, self.y_min = self.x[valid].min(), self.y[valid].min()
+            x_span, y_span = self.x[valid].max() - self.x_min, self.y[valid].max() - self.y_min
+        else:
+            self.x_min = self.y_min = x_span = y_span = 0
+        n_target = max(1., len(valid) / float(self.points_per_cell))
+        if x_span * y_span > 0:
+            self.cell_size = np.sqrt(x_span * y_span / n_target)
+        else:
+            self.cell_size = max(x_span, y_span) / n_target or 1.
+        self.x_min -= margin * x_span
+        self.y_min -= margin * y_span
+        self.n_x = int((1 + 2*margin) * x_span / self.cell_size) + 1
+        self.n_y = int((1 + 2*margin) * y_span / self.cell_size) + 1
+        self.n_laid_out = len(valid)
+
+        cx, cy = self.cell_of(self.x[valid], self.y[valid])
+        cells = np.clip(cx, 0, self.n_x-1) * self.n_y + np.clip(cy, 0, self.n_y-1)
+        order = np.argsort(cells, kind='mergesort')
+        self.indices = valid[order]
+        self.starts = np.searchsorted(cells[order], np.arange(self.n_x * self.n_y + 1))
+
+    def extend(self, x, y):
+        """
+        Add points, numbered on from those already held. They are slotted into
+        the cells they fall in, unless some fall outside the grid, or the
+        cells would hold over twice the points they were laid out for, when
+        the grid is laid out again with room to grow.
+        """
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        n_old = len(self.x)
+        self.x, self.y = np.concatenate([self.x, x]), np.concatenate([self.y, y])
+        valid = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+        if not len(valid):
+            return
+        cx, cy = self.cell_of(x[valid], y[valid])
+        inside = (cx >= 0) & (cx < self.n_x) & (cy >= 0) & (cy < self.n_y)
+        if not inside.all() or len(self) + len(valid) > 2 * self.n_laid_out:
+            self.lay_out(self.margin)
+            return
+        cells = cx * self.n_y + cy
+        order = np.argsort(cells, kind='mergesort')
+        cells = cells[order]
+        # Each goes after the points already in its cell, which end where the next cell starts
+        self.indices = np.insert(self.indices, self.starts[cells + 1], n_old + valid[order])
+        counts = np.bincount(cells, minlength=self.n_x * self.n_y)
+        self.starts = self.starts + np.concatenate([[0], np.cumsum(counts)])
+
+    def __len__(self):
+        return len(self.indices)
+
+    def cell_of(self, x, y):
+        return (np.floor((x - self.x_min) / self.cell_size).astype(int),
+                np.floor((y - self.y_min) / self.cell_size).astype(int))
+
+    def nearest(self, x, y):
+        """Index of the point closest to (x, y), or None if there are no points"""
+        if not len(self):
+            return None
+        cx, cy = [int(c) for c in self.cell_of(np.array(x), np.array(y))]
+        # Skip rings lying entirely outside the grid, then search rings r_lo..r_hi,
+        # doubling the width while they come up empty. Once a point is found
+        # every ring which could hold a closer one is searched in one go.
+        r_lo = max(0, -cx, cx - (self.n_x-1), -cy, cy - (self.n_y-1))
+        r_max = max(cx, self.n_x-1-cx, cy, self.n_y-1-cy)
+        r_hi = r_lo
+        best, best_dist = None, np.inf
+        while r_lo <= r_max and (r_lo - 1) * self.cell_size <= np.sqrt(best_dist):
+            candidates = self.points_in(self.rings(cx, cy, r_lo, r_hi))
+            if len(candidates):
+                dists = (self.x[candidates] - x)**2 + (self.y[candidates] - y)**2
+                i = np.argmin(dists)
+                if dists[i] < best_dist:
+                    best, best_dist = candidates[i], dists[i]
+            if best is None:
+                r_lo, r_hi = r_hi + 1, 2*r_hi + 1
+            else:
+                r_lo, r_hi = r_hi + 1, int(np.sqrt(best_dist) / self.cell_size) + 1
+        return best
+
+    def rings(self, cx, cy, r_lo, r_hi):
+        """Flat indices of the in-grid cells at Chebyshev distance r_lo to r_hi from (cx, cy)"""
+        xs = np.arange(max(cx - r_hi, 0), min(cx + r_hi, self.n_x - 1) + 1)
+        ys = np.arange(max(cy - r_hi, 0), min(cy + r_hi, self.n_y - 1) + 1)
+        xs, ys = np.meshgrid(xs, ys, indexing='ij')
+        outer = np.maximum(abs(xs - cx), abs(ys - cy)) >= r_lo
+        return xs[outer] * self.n_y + ys[outer]
+
+    def points_in(self, cells):
+        """Indices of the points in the given cells"""
+        starts, stops = self.starts[cells], self.starts[cells + 1]
+        lengths = stops - starts
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return self.indices[np.arange(lengths.sum()) + offsets]
@@ -1,13 +1,28 @@
 import warnings
+import weakref
+import threading
 import time
+from collections import OrderedDict
 
 from PyQt4 import Qt
 import pyqtgraph as pg
-import pyqtgraph.opengl as gl
 import pyqtgraph.dockarea
 import numpy as np
 
-from window import WindowMultiPlot
+from lod import MinMaxPyramid, ImagePyramid, SurfaceGrid
+from levels import RunningLevels
+from spatial import PointGrid
+from buffers import GrowableArray, AxisCache, merge_ranges
+from profiling import profiler
+
+_gl = None
+def gl():
+    """pyqtgraph.opengl, imported on first use so that startup doesn't pay for setting up OpenGL"""
+    global _gl
+    if _gl is None:
+        import pyqtgraph.opengl
+        _gl = pyqtgraph.opengl
+    return _gl
 
 class MyDockArea(pg.dockarea.DockArea):
     def __init__(self, *args, **kwargs):
@@ -16,7 +31,6 @@ class MyDockArea(pg.dockarea.DockArea):
         self.last_dock, self.second_last_dock = None, None
         self._docks = {}
         self.max_plot_count = 4
-        self.update_log = []
 
     def remove_dock(self, dock):
         dock.setParent(None)
@@ -71,24 +85,27 @@ class MyDockArea(pg.dockarea.DockArea):
                 self.remove_dock(d)
 
 class NodeEditWidget(Qt.QFrame):
-    def __init__(self, path, attrs):
+    """
+    Attribute editor for the data tree. A single one is shared by all the
+    items, and bound to whichever is selected.
+    """
+    def __init__(self):
         Qt.QFrame.__init__(self)
         self.setFrameStyle(Qt.QFrame.Panel)
-        self.path = path
+        self.path = None
+        self.attrs = {}
         self.spin_widgets = {}
         self.proxy = None
 
         self.setLayout(Qt.QVBoxLayout())
-        self.layout().addWidget(Qt.QLabel('Editing ' + '/'.join(self.path)))
+        self.path_label = Qt.QLabel('')
+        self.layout().addWidget(self.path_label)
 
         self.attr_list = Qt.QTreeWidget()
         self.attr_list.setRootIsDecorated(False)
         self.attr_list.setColumnCount(2)
         self.attr_list.setHeaderLabels(['Name', 'Value', 'Type'])
 
-        for attr, value in attrs.items():
-            self.attr_list.addTopLevelItem(Qt.QTreeWidgetItem([attr, self.repr_value(value), str(type(value))]))
-
         add_attr_box = Qt.QWidget()
         add_attr_box.setLayout(Qt.QHBoxLayout())
         self.attr_name_edit = Qt.QLineEdit()
@@ -96,7 +113,6 @@ class NodeEditWidget(Qt.QFrame):
         self.attr_value_edit.returnPressed.connect(self.add_attribute)
         self.attr_list.itemClicked.connect(self.attr_clicked)
         self.add_attr_button = Qt.QPushButton('Add Attribute')
-        self.add_attr_button = Qt.QPushButton('Add Attribute')
         self.add_attr_button.clicked.connect(self.add_attribute)
         add_attr_box.layout().addWidget(Qt.QLabel('name'))
         add_attr_box.layout().addWidget(self.attr_name_edit)
@@ -110,6 +126,24 @@ class NodeEditWidget(Qt.QFrame):
         self.layout().addWidget(add_attr_box)
 
         self.attr_list_items = {}
+        self.clear()
+
+    def bind(self, path, attrs, proxy=None):
+        """Show and edit the attrs of the item at path, through proxy if it has one"""
+        self.path = path
+        self.attrs = attrs
+        self.proxy = proxy
+        self.path_label.setText('Editing ' + '/'.join(path))
+        self.attr_list.clear()
+        self.attr_list_items = {}
+        self.update_attrs(attrs)
+        self.setEnabled(True)
+
+    def clear(self):
+        self.bind((), {})
+        self.path = None
+        self.path_label.setText('')
+        self.setEnabled(False)
 
     def repr_value(self, v):
         if isinstance(v, float) and v > 1e4:
@@ -117,9 +151,6 @@ class NodeEditWidget(Qt.QFrame):
         else:
             return str(v)
 
-    def set_proxy(self, proxy):
-        self.proxy = proxy
-
     def update_attrs(self, attrs):
         for k, v in attrs.items():
             if k not in self.attr_list_items:
@@ -165,18 +196,67 @@ class NodeEditWidget(Qt.QFrame):
         if self.proxy is not None:
             self.proxy.set_attrs(**{name: value})
         else:
-            if self.new_attr:
-                self.attr_list.addTopLevelItem(Qt.QTreeWidgetItem([name, self.repr_value(value), str(type(value))]))
-            else:
-                i = self.attr_list.findItems(name, Qt.Qt.MatchExactly, 0)[0]
-                i.setText(1, str(value))
+            self.attrs[name] = value
+            self.update_attrs({name: value})
             self.attr_name_edit.setText("")
             self.attr_value_edit.setText("")
             return name, value
 
 
+class ProfilingPanel(Qt.QFrame):
+    """
+    Live table of the profiler's timings per path and stage, refreshed while
+    the panel is visible.
+    """
+    refresh_interval = 1000 # ms
+    columns = ['Path', 'Stage', 'Count', 'Rate (/s)', 'Mean (ms)', 'Max (ms)', 'MB']
+
+    def __init__(self):
+        Qt.QFrame.__init__(self)
+        self.setFrameStyle(Qt.QFrame.Panel)
+        self.setLayout(Qt.QVBoxLayout())
+
+        self.stats_list = Qt.QTreeWidget()
+        self.stats_list.setRootIsDecorated(False)
+        self.stats_list.setColumnCount(len(self.columns))
+        self.stats_list.setHeaderLabels(self.columns)
+        self.layout().addWidget(self.stats_list)
+
+        self.reset_button = Qt.QPushButton('Reset')
+        self.reset_button.clicked.connect(self.reset)
+        self.layout().addWidget(self.reset_button)
+
+        self.refresh_timer = Qt.QTimer()
+        self.refresh_timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.refresh_timer.start(self.refresh_interval)
+        Qt.QFrame.showEvent(self, event)
+
+    def hideEvent(self, event):
+        self.refresh_timer.stop()
+        Qt.QFrame.hideEvent(self, event)
+
+    def reset(self):
+        profiler.reset()
+        self.refresh()
+
+    def refresh(self):
+        self.stats_list.clear()
+        for path, stages in sorted(profiler.summary().items()):
+            for stage, stats in sorted(stages.items()):
+                self.stats_list.addTopLevelItem(Qt.QTreeWidgetItem([
+                    path, stage, str(stats['count']), '%.1f' % stats['rate'],
+                    '%.2f' % stats['mean_ms'], '%.2f' % stats['max_ms'],
+                    '%.2f' % (stats['bytes'] / 1e6),
+                ]))
+
+
 class ItemWidget(pg.dockarea.Dock):
     dock_area = None
+    workers = None # WorkerPool preparing frames in the background, if there is one
+    axes = AxisCache() # x arrays shared between the plots
     def __init__(self, item, **kwargs):
         ident = item.strpath
 
@@ -198,6 +278,8 @@ class ItemWidget(pg.dockarea.Dock):
         self.label.setFont(Qt.QFont('Helvetica', pointSize=pointSize))
         self.ident = ident
         self.window_item = item
+        self.frame_lock = threading.Lock()
+        self.next_frame = None # (data, attrs, changed, options) waiting to be prepared
 
         self.plots_widget = Qt.QWidget()
         self.plots_widget.setLayout(Qt.QVBoxLayout())
@@ -213,6 +295,7 @@ class ItemWidget(pg.dockarea.Dock):
         self.maximize_button.clicked.connect(lambda: self.dock_area.hide_all_but(self))
         self.update_toggle = Qt.QCheckBox('Update')
         self.update_toggle.setChecked(True)
+        self.update_toggle.toggled.connect(self.update_toggled)
 
 
         self.buttons_widget.layout().addWidget(self.remove_button)
@@ -230,6 +313,14 @@ class ItemWidget(pg.dockarea.Dock):
     def is_visible(self):
         return self.parent() is not None
 
+    def is_live(self):
+        """Visible, and not paused with the Update checkbox"""
+        return self.is_visible() and self.update_toggle.isChecked()
+
+    def update_toggled(self, checked):
+        if checked and self.window_item.stale:
+            self.window_item.catch_up()
+
     def toggle_hide(self, show=None):
         if show is None:
             show = not self.is_visible()
@@ -238,6 +329,8 @@ class ItemWidget(pg.dockarea.Dock):
             self.dock_area.remove_dock(self)
         elif show:
             self.dock_area.add_dock_auto_location(self)
+            if self.window_item.stale:
+                self.window_item.catch_up()
 
     def update_params(self, **kwargs):
         self.__dict__.update(kwargs)
@@ -246,18 +339,74 @@ class ItemWidget(pg.dockarea.Dock):
     def add_plot_widget(self, **kwargs):
         raise NotImplementedError
 
-    def update_plot(self, data, attrs=None):
+    def update_plot(self, data, attrs=None, changed=None):
+        """
+        Draw data. changed is the (start, stop) range of rows modified since the
+        last update, or None if anything may have changed.
+        """
         self.timestamp = time.time()
 
     def clear_plot(self):
         raise NotImplementedError
 
+    def submit_frame(self, data, attrs, changed=None):
+        """
+        Draw data through prepare and render, the first on a worker thread if
+        there is a pool. Frames arriving while one is being prepared collapse
+        into the newest, with their changed ranges merged.
+
+        data is usually a view of storage the GUI thread goes on writing to,
+        a GrowableArray or a shared memory map, so a worker is given a copy.
+        """
+        options = self.frame_options()
+        if self.workers is None:
+            self.render_timed(self.prepare_timed(data, attrs, changed, options))
+            return
+        data, attrs = np.array(data), dict(attrs)
+        with self.frame_lock:
+            if self.next_frame is not None:
+                changed = merge_ranges(self.next_frame[2], changed)
+            self.next_frame = (data, attrs, changed, options)
+        self.workers.submit(self, self.prepare_next, self.render_timed)
+
+    def prepare_next(self):
+        with self.frame_lock:
+            frame, self.next_frame = self.next_frame, None
+        return None if frame is None else self.prepare_timed(*frame)
+
+    def prepare_timed(self, *frame):
+        with profiler.timed(self.window_item.strpath, 'prepare'):
+            return self.prepare(*frame)
+
+    def render_timed(self, frame):
+        with profiler.timed(self.window_item.strpath, 'draw'):
+            self.render(frame)
+
+    def is_preparing(self):
+        return self.workers is not None and self.workers.is_busy(self)
+
+    def frame_options(self):
+        """Widget state prepare needs, read here on the GUI thread"""
+        return {}
+
+    def prepare(self, data, attrs, changed, options):
+        """
+        The array work for a frame, returning what render needs. This may run
+        on a worker thread, so it must not touch any widgets.
+        """
+        raise NotImplementedError
+
+    def render(self, frame):
+        """Hand a prepared frame to the widgets, on the GUI thread"""
+        raise NotImplementedError
+
 
 class Rank1ItemWidget(ItemWidget):
     rank = 1
     plot_attrs = ["x0", "xscale",
                   "xlabel", "ylabel",
                   "parametric", "plot_args"]
+    lod_threshold = 20000 # Longer traces are drawn as min/max envelopes
     def __init__(self, item, **kwargs):
         ItemWidget.__init__(self, item, **kwargs)
 
@@ -266,36 +415,70 @@ class Rank1ItemWidget(ItemWidget):
         self.line_plt.plotItem.showGrid(x=True, y=True)
         self.plots_widget.layout().addWidget(self.line_plt)
         self.curve = None
+        self.lods = {} # curve -> (MinMaxPyramid, x0, xscale)
+        self.line_plt.plotItem.getViewBox().sigXRangeChanged.connect(self.refresh_lods)
 
-    def update_plot(self, data, attrs=None):
-        super(Rank1ItemWidget, self).update_plot(data, attrs)
+    def update_plot(self, data, attrs=None, changed=None):
+        super(Rank1ItemWidget, self).update_plot(data, attrs, changed)
         if attrs is None:
             attrs = {}
 
+        if data is None or data.shape[0] is 0:
+            self.clear_plot()
+            return
+
+        if not self.update_toggle.isChecked():
+            return
+
+        self.submit_frame(data, attrs, changed)
+
+    def prepare(self, data, attrs, changed, options):
+        return self.prepare_trace(data, attrs, changed, self.lods.get(self.curve, (None,))[0])
+
+    def render(self, frame):
+        self.render_trace(frame)
+
+    def draw_trace(self, data, attrs):
+        """Draw data on self.curve straight away"""
+        self.render_trace(self.prepare_trace(data, attrs, None, self.lods.get(self.curve, (None,))[0]))
+
+    def prepare_trace(self, data, attrs, changed, lod=None):
+        """
+        x and y arrays for data, or for long traces no arrays but lod, their
+        MinMaxPyramid brought up to date.
+        """
+        x0 = attrs.get("x0", 0)
+        xscale = attrs.get("xscale", 1)
+        if attrs.get("parametric", False):
+            lod = None
+            if data.shape[0] == 2:
+                xdata, ydata = data
+            elif data.shape[1] == 2:
+                xdata, ydata = data.T
+            else:
+                raise ValueError('data claims to be parametric, but shape is ' + str(data.shape))
+        elif len(data) > self.lod_threshold:
+            if lod is None:
+                lod = MinMaxPyramid()
+            lod.update(data, changed)
+            xdata, ydata = None, None
+        else:
+            lod = None
+            ydata = data
+            xdata = self.axes.get(x0, xscale, len(data))
+        return attrs, xdata, ydata, lod
+
+    def render_trace(self, frame):
+        attrs, xdata, ydata, lod = frame
         x0 = attrs.get("x0", 0)
         xscale = attrs.get("xscale", 1)
         xlabel = attrs.get("xlabel", "X")
         ylabel = attrs.get("ylabel", "Y")
-        parametric = attrs.get("parametric", False)
-        self.line_plt.parametric = parametric
+        self.line_plt.parametric = attrs.get("parametric", False)
         plot_args = attrs.get("plot_args", {})
 
-
-        if data is None or data.shape[0] is 0:
-            self.clear_plot()
-            return
-
-        if self.update_toggle.isChecked():
-            if parametric:
-                if data.shape[0] == 2:
-                    xdata, ydata = data
-                elif data.shape[1] == 2:
-                    xdata, ydata = data.T
-                else:
-                    raise ValueError('data claims to be parametric, but shape is ' + str(data.shape))
-            else:
-                ydata = data
-                xdata = np.linspace(x0, x0+(xscale*(len(ydata)-1)), len(data))
+        if lod is not None:
+            xdata, ydata = self.lod_view(lod, x0, xscale)
 
         self.line_plt.plotItem.setLabels(bottom=(xlabel,), left=(ylabel,))
 
@@ -304,8 +487,29 @@ class Rank1ItemWidget(ItemWidget):
         else:
             self.curve.setData(x=xdata, y=ydata, **plot_args)
 
+        self.lods.pop(self.curve, None)
+        if lod is not None:
+            self.lods[self.curve] = (lod, x0, xscale)
+
+    def lod_view(self, lod, x0, xscale):
+        """The envelope of a long trace, at about one min/max pair per visible pixel"""
+        vb = self.line_plt.plotItem.getViewBox()
+        (view_x0, view_x1), _ = vb.viewRange()
+        bounds = sorted([(view_x0 - x0) / float(xscale), (view_x1 - x0) / float(xscale)])
+        start, stop = int(np.floor(bounds[0])), int(np.ceil(bounds[1])) + 1
+        positions, ydata = lod.viewport(start, stop, max(int(vb.width()), 100))
+        return x0 + xscale*positions, ydata
+
+    def refresh_lods(self, *args):
+        if self.is_preparing():
+            return # The pyramids are being updated, and will be redrawn after
+        for curve, (lod, x0, xscale) in self.lods.items():
+            xdata, ydata = self.lod_view(lod, x0, xscale)
+            curve.setData(x=xdata, y=ydata)
+
     def clear_plot(self):
         if self.curve is not None:
+            self.lods.pop(self.curve, None)
             self.line_plt.removeItem(self.curve)
             self.curve = None
 
@@ -315,28 +519,54 @@ class MultiplotItemWidget(Rank1ItemWidget):
         Rank1ItemWidget.add_plot_widget(self, **kwargs)
         self.curves = {}
 
-    def update_path(self, path, data, attrs=None):
+    def update_path(self, path, data, attrs=None, changed=None):
         if path not in self.curves:
             self.curves[path] = self.line_plt.plot([], pen=tuple(random_color()), name='/'.join(path))
         self.curve = self.curves[path] # This is kind of a hack isn't it. How do you OOP again?
-        Rank1ItemWidget.update_plot(self, data, attrs)
+        if attrs is None:
+            attrs = {}
+        if data is None or len(data) == 0:
+            self.clear_plot()
+        elif self.update_toggle.isChecked():
+            self.draw_trace(data, attrs)
 
 
 class ParametricItemWidget(Rank1ItemWidget):
+    """
+    Plots two rank 1 sources against each other.
+
+    The pairs are kept in an (n, 2) GrowableArray, each source writing only
+    its changed samples into its own column. The curve is drawn from a copy
+    of the rows where both are filled in, as setData can only replace a
+    curve's arrays, not extend them, and keeps hold of the ones it is given.
+    """
     def __init__(self, item, **kwargs):
         Rank1ItemWidget.__init__(self, item, **kwargs)
         self.path1, self.path2 = [i.path for i in item.sources]
-        self.datas = {self.path1: [], self.path2: []}
+        self.pairs = GrowableArray(np.zeros((0, 2)))
+        self.lengths = {self.path1: 0, self.path2: 0} # Samples written to each column
         self.transpose_toggle = Qt.QCheckBox('Transpose')
         self.transpose_toggle.stateChanged.connect(lambda s: self.refresh_plot())
         self.buttons_widget.layout().addWidget(self.transpose_toggle)
 
-    def update_path(self, path, data, attrs=None):
-        self.datas[path] = data
-        self.refresh_plot(attrs)
-
-    def refresh_plot(self, attrs=None):
-        data = np.array(zip(self.datas[self.path1],  self.datas[self.path2]))
+    def n_pairs(self):
+        return min(self.lengths.values())
+
+    def update_path(self, path, data, attrs=None, changed=None):
+        column = 0 if path == self.path1 else 1
+        data = np.asarray(data)
+        n_old, n_pairs_old = self.lengths[path], self.n_pairs()
+        start = 0
+        if changed is not None and len(data) >= n_old:
+            start = min(changed[0], n_old)
+        if len(data) > len(self.pairs):
+            self.pairs.resize(len(data))
+        self.pairs[start:len(data), column] = data[start:]
+        self.lengths[path] = len(data)
+        self.refresh_plot(attrs, (min(start, n_pairs_old), self.n_pairs()))
+
+    def refresh_plot(self, attrs=None, changed=None):
+        data = np.array(self.pairs[:self.n_pairs()].T) # Rows x and y
         if attrs is None:
             attrs = {}
         attrs = attrs.copy()
@@ -344,9 +574,9 @@ class ParametricItemWidget(Rank1ItemWidget):
         attrs['xlabel'] = '/'.join(self.path1)
         attrs['ylabel'] = '/'.join(self.path2)
         if self.transpose_toggle.isChecked():
-            data = np.transpose(np.array([data[:, 1], data[:, 0]]))
+            data = data[::-1]
             attrs['xlabel'], attrs['ylabel'] = attrs['ylabel'], attrs['xlabel']
-        self.update_plot(data, attrs)
+        self.update_plot(data, attrs, changed)
 
 
 class Rank2ItemWidget(Rank1ItemWidget):
@@ -354,7 +584,10 @@ class Rank2ItemWidget(Rank1ItemWidget):
     plot_attrs = ["x0", "xscale",
                   "y0", "yscale",
                   "xlabel", "ylabel", "zlabel",
-                  "parametric", "plot_args"]
+                  "parametric", "plot_args", "levels_percentile",
+                  "surface_vertices", "expected_rows"]
+    pyramid_threshold = 2048*2048 # Larger images are drawn from an ImagePyramid
+    surface_vertices = 256*256 # Default vertex budget of the surface view
 
     def __init__(self, item, **kwargs):
         Rank1ItemWidget.__init__(self, item, **kwargs)
@@ -394,8 +627,8 @@ class Rank2ItemWidget(Rank1ItemWidget):
 
     def set_line(self, value):
         print 'set line', value
-        if self.cur_data is not None:
-            Rank1ItemWidget.update_plot(self, self.cur_data[value, :], self.cur_attrs)
+        if self.cur_data is not None and self.update_toggle.isChecked():
+            self.draw_trace(self.cur_data[value, :], self.cur_attrs)
 
     def show_img_plot(self):
         self.img_view.show()
@@ -415,12 +648,14 @@ class Rank2ItemWidget(Rank1ItemWidget):
             widget.hide()
 
         if self.gl_view is None:
-            self.gl_view = gl.GLViewWidget()
+            self.gl_view = gl().GLViewWidget()
             self.gl_view.setSizePolicy(Qt.QSizePolicy.Expanding, Qt.QSizePolicy.Expanding)
             self.plots_widget.layout().addWidget(self.gl_view)
-            if self.img_view.image is not None:
-                self.update_plot(self.img_view.image)
         self.gl_view.show()
+        # The surface isn't kept up to date while hidden
+        self.surface_grid = None
+        if self.cur_data is not None:
+            self.update_plot(self.cur_data, self.cur_attrs)
 
     def show_line_plot(self):
         self.img_view.hide()
@@ -442,13 +677,61 @@ class Rank2ItemWidget(Rank1ItemWidget):
         self.plots_widget.layout().addWidget(self.img_view)
         #self.addWidget(self.line_plt)
 
+        self.pyramid = None
+        self.running_levels = RunningLevels()
+        self.drawing_image = False
+        self.img_view.getView().vb.sigRangeChanged.connect(self.refresh_pyramid)
+
         self.gl_view = None
         self.surface = None
+        self.surface_grid = None
 
-    def update_plot(self, data, attrs=None):
+    def update_plot(self, data, attrs=None, changed=None):
         if attrs is None:
             attrs = {}
 
+        self.cur_data = data
+        self.cur_attrs = attrs
+
+        if data is None:
+            self.clear_plot()
+            return
+
+        if self.update_toggle.isChecked():
+            self.submit_frame(data, attrs, changed)
+
+    def frame_options(self):
+        return {
+            'autolevels': self.autolevels_check.isChecked(),
+            'surface': self.gl_view is not None and self.gl_view.isVisible(),
+            'surface_grid': self.surface_grid,
+        }
+
+    def prepare(self, data, attrs, changed, options):
+        levels = None
+        if options['autolevels']:
+            self.running_levels.update(data, changed)
+            levels = self.running_levels.levels(attrs.get("levels_percentile"))
+        pyramid = None
+        if data.size > self.pyramid_threshold:
+            pyramid = self.pyramid
+            if pyramid is None:
+                pyramid = ImagePyramid()
+            pyramid.update(data, changed)
+        grid = surface_changed = None # The latter becomes whether the surface mesh has to be rebuilt
+        if options['surface']:
+            grid = options['surface_grid']
+            max_vertices = attrs.get("surface_vertices", self.surface_vertices)
+            expected_rows = attrs.get("expected_rows")
+            if grid is None or grid.max_vertices != max_vertices or grid.expected_rows != expected_rows:
+                grid = SurfaceGrid(max_vertices)
+            surface_changed = grid.update(data, changed, expected_rows)
+        return data, attrs, levels, pyramid, grid, surface_changed
+
+    def render(self, frame):
+        data, attrs, levels, self.pyramid, grid, surface_changed = frame
+        if surface_changed is not None:
+            self.surface_grid = grid
         x0 = attrs.get("x0", 0)
         y0 = attrs.get("y0", 0)
         xscale = attrs.get("xscale", 1)
@@ -456,42 +739,62 @@ class Rank2ItemWidget(Rank1ItemWidget):
         xlabel = attrs.get("xlabel", "X")
         ylabel = attrs.get("ylabel", "Y")
         zlabel = attrs.get("zlabel", "Z")
-        plot_args = attrs.get("plot_args", {})
 
-        self.cur_data = data
-        self.cur_attrs = attrs
+        self.line_scrubber.setMaximum(len(data)-1)
 
-        if data is None:
-            self.clear_plot()
-            return
+        self.img_view.setLabels(xlabel, ylabel, zlabel)
+        if self.most_recent_check.isChecked():
+            self.line_scrubber.setValue(len(data)-1) # This updates the line plot
 
-        if self.update_toggle.isChecked():
-
-            self.line_scrubber.setMaximum(len(data)-1)
-
-            self.img_view.setLabels(xlabel, ylabel, zlabel)
-            if self.most_recent_check.isChecked():
-                self.line_scrubber.setValue(len(data)-1) # This updates the line plot
-
-            # Well, this is a hack. I'm not sure why autorange is disabled after setImage
-            autorange = self.img_view.getView().vb.autoRangeEnabled()[0]
-            autolevels = self.autolevels_check.isChecked()
-            self.img_view.setImage(data, autoRange=autorange, autoLevels=autolevels, pos=[x0, y0], scale=[xscale, yscale])
-            self.img_view.getView().vb.enableAutoRange(enable=autorange)
-
-            if self.gl_view is not None:
-                if self.surface is None or data.shape != self.surface._z.shape:
-                    x1 = x0 + data.shape[0]*xscale
-                    y1 = y0 + data.shape[1]*yscale
-                    xs = np.arange(x0, x1, xscale)
-                    ys = np.arange(y0, y1, yscale)
-                    #grid = gl.GLGridItem()
-                    #self.gl_view.addItem(grid)
-                    if self.surface is not None:
-                        self.gl_view.removeItem(self.surface)
-                    self.surface = gl.GLSurfacePlotItem(x=xs, y=ys, shader='shaded')
-                    self.gl_view.addItem(self.surface)
-                self.surface.setData(z=data)
+        # Well, this is a hack. I'm not sure why autorange is disabled after setImage
+        autorange = self.img_view.getView().vb.autoRangeEnabled()[0]
+        if self.pyramid is not None:
+            image, pos, scale = self.pyramid_view(x0, y0, xscale, yscale, full=autorange)
+        else:
+            image, pos, scale = data, [x0, y0], [xscale, yscale]
+        self.drawing_image = True
+        self.img_view.setImage(image, autoRange=autorange, autoLevels=False, levels=levels,
+                               pos=pos, scale=scale, source=(data, [x0, y0], [xscale, yscale]))
+        self.img_view.getView().vb.enableAutoRange(enable=autorange)
+        self.drawing_image = False
+
+        if surface_changed is not None and self.surface_grid is not None:
+            if self.surface is None or surface_changed:
+                xs, ys = self.surface_grid.coords(x0, y0, xscale, yscale)
+                #grid = gl().GLGridItem()
+                #self.gl_view.addItem(grid)
+                if self.surface is not None:
+                    self.gl_view.removeItem(self.surface)
+                self.surface = gl().GLSurfacePlotItem(x=xs, y=ys, shader='shaded')
+                self.gl_view.addItem(self.surface)
+            self.surface.setData(z=self.surface_grid.z)
+
+    def pyramid_view(self, x0, y0, xscale, yscale, full=False):
+        """The pyramid level and crop to draw for the current view, with its pos and scale"""
+        vb = self.img_view.getView().vb
+        n_rows, n_cols = self.pyramid.shape
+        if full:
+            rows, cols = (0, n_rows), (0, n_cols)
+        else:
+            (view_x0, view_x1), (view_y0, view_y1) = vb.viewRange()
+            rows = sorted([(view_x0 - x0) / float(xscale), (view_x1 - x0) / float(xscale)])
+            cols = sorted([(view_y0 - y0) / float(yscale), (view_y1 - y0) / float(yscale)])
+        image, (i0, j0), step = self.pyramid.region(rows, cols, vb.width(), vb.height())
+        return image, [x0 + i0*xscale, y0 + j0*yscale], [xscale*step, yscale*step]
+
+    def refresh_pyramid(self, *args):
+        if self.pyramid is None or self.drawing_image or not self.update_toggle.isChecked():
+            return
+        if self.is_preparing():
+            return # The pyramid is being updated, and will be redrawn after
+        attrs = self.cur_attrs
+        x0, y0 = attrs.get("x0", 0), attrs.get("y0", 0)
+        xscale, yscale = attrs.get("xscale", 1), attrs.get("yscale", 1)
+        image, pos, scale = self.pyramid_view(x0, y0, xscale, yscale)
+        self.drawing_image = True
+        self.img_view.setImage(image, autoRange=False, autoLevels=False, pos=pos, scale=scale,
+                               source=(self.cur_data, [x0, y0], [xscale, yscale]))
+        self.drawing_image = False
 
     def clear_plot(self):
         Rank1ItemWidget.clear_plot(self)
@@ -513,13 +816,13 @@ class Rank2ItemWidget(Rank1ItemWidget):
 
 class Rank2ParametricWidget(ItemWidget):
     def add_plot_widget(self):
-        self.gl_view = gl.GLViewWidget()
+        self.gl_view = gl().GLViewWidget()
         self.gl_view.setSizePolicy(Qt.QSizePolicy.Expanding, Qt.QSizePolicy.Expanding)
         self.plots_widget.layout().addWidget(self.gl_view)
-        self.scatter = gl.GLScatterPlotItem(color=(1,1,1,.3), size=.1, pxMode=False)
+        self.scatter = gl().GLScatterPlotItem(color=(1,1,1,.3), size=.1, pxMode=False)
         self.gl_view.addItem(self.scatter)
 
-    def update_plot(self, data, attrs=None):
+    def update_plot(self, data, attrs=None, changed=None):
         self.scatter.setData(pos=data)
 
 
@@ -532,6 +835,7 @@ class CrosshairPlotWidget(pg.PlotWidget):
         self.parametric = parametric
         self.search_mode = True
         self.label = None
+        self.point_grids = weakref.WeakKeyDictionary() # data item -> (xData, yData, PointGrid)
 
     def toggle_search(self, mouse_event):
         if mouse_event.double():
@@ -557,7 +861,9 @@ class CrosshairPlotWidget(pg.PlotWidget):
                     xdata, ydata = data_item.xData, data_item.yData
                     index_distance = lambda i: (xdata[i]-view_x)**2 + (ydata[i] - view_y)**2
                     if self.parametric:
-                        index = min(range(len(xdata)), key=index_distance)
+                        index = self.point_grid(data_item).nearest(view_x, view_y)
+                        if index is None:
+                            continue
                     else:
                         index = min(np.searchsorted(xdata, view_x), len(xdata)-1)
                         if index and xdata[index] - view_x > view_x - xdata[index - 1]:
@@ -573,6 +879,26 @@ class CrosshairPlotWidget(pg.PlotWidget):
             self.h_line.setPos(pt_y)
             self.label.setText("x=%.2e, y=%.2e" % (pt_x, pt_y))
 
+    def point_grid(self, data_item):
+        """
+        A PointGrid over the item's points. When new data starts with the
+        points already held, as after an append, only the rest are added to
+        it, otherwise it is rebuilt.
+        """
+        xdata, ydata = data_item.xData, data_item.yData
+        cached = self.point_grids.get(data_item)
+        if cached is not None and cached[0] is xdata and cached[1] is ydata:
+            return cached[2]
+        grid = None if cached is None else cached[2]
+        n = 0 if grid is None else len(grid.x)
+        if (grid is not None and xdata is not None and len(xdata) >= n and
+                np.array_equal(xdata[:n], grid.x) and np.array_equal(ydata[:n], grid.y)):
+            grid.extend(xdata[n:], ydata[n:])
+        else:
+            grid = PointGrid(xdata, ydata)
+        self.point_grids[data_item] = (xdata, ydata, grid)
+        return grid
+
     def add_cross_hair(self):
         self.h_line = pg.InfiniteLine(angle=0, movable=False)
         self.v_line = pg.InfiniteLine(angle=90, movable=False)
@@ -591,6 +917,19 @@ class CrosshairPlotWidget(pg.PlotWidget):
         self.cross_section_enabled = False
 
 class CrossSectionWidget(pg.ImageView):
+    """
+    An ImageView with x and y traces through a crosshair.
+
+    Traces follow the mouse at most max_fps times a second, and a trace is
+    only redrawn when its row or column changed. Columns are strided in the
+    (x, y) image, so once a second column is read from the same block of
+    column_block columns, the block is transposed into contiguous memory.
+    The most recent max_column_blocks blocks are kept until the image changes.
+    """
+    max_fps = 60
+    column_block = 64
+    max_column_blocks = 32
+
     def __init__(self, trace_size=80, **kwargs):
         view = pg.PlotItem(labels=kwargs.pop('labels', None))
         pg.ImageView.__init__(self, view=view, **kwargs)
@@ -622,6 +961,15 @@ class CrossSectionWidget(pg.ImageView):
         self.v_cross_section_widget_data = self.v_cross_section_widget.plot([0,0])
         self.v_cross_dock.addWidget(self.v_cross_section_widget)
 
+        self.source = None
+        self.column_blocks = OrderedDict() # block index -> contiguous transposed columns
+        self.column_reads = {} # block index -> columns read from it since the image changed
+        self.drawn_indices = (None, None) # (x, y) indices of the traces on display
+        self.cross_section_timer = Qt.QTimer()
+        self.cross_section_timer.setSingleShot(True)
+        self.cross_section_timer.setInterval(1000 // self.max_fps)
+        self.cross_section_timer.timeout.connect(self.update_cross_section)
+
     def setLabels(self, xlabel="X", ylabel="Y", zlabel="Z"):
         self.view.setLabels(bottom=(xlabel,), left=(ylabel,))
         self.h_cross_section_widget.plotItem.setLabels(bottom=xlabel, left=zlabel)
@@ -629,13 +977,19 @@ class CrossSectionWidget(pg.ImageView):
         #self.setLabels(xlabel, ylabel)
         self.ui.histogram.item.axis.setLabel(text=zlabel)
 
-    def setImage(self, *args, **kwargs):
-        if 'pos' in kwargs:
-            self._x0, self._y0 = kwargs['pos']
-        if 'scale' in kwargs:
-            self._xscale, self._yscale = kwargs['scale']
-
-        pg.ImageView.setImage(self, *args, **kwargs)
+    def setImage(self, img, source=None, **kwargs):
+        """
+        source, if given, is the (data, pos, scale) of the full resolution image
+        which img was reduced from. Cross sections are taken from it.
+        """
+        if source is None:
+            source = (img, kwargs.get('pos', [0, 0]), kwargs.get('scale', [1, 1]))
+        self.source, (self._x0, self._y0), (self._xscale, self._yscale) = source
+        self.column_blocks.clear()
+        self.column_reads.clear()
+        self.drawn_indices = (None, None)
+
+        pg.ImageView.setImage(self, img, **kwargs)
         self.update_cross_section()
 
     def toggle_cross_section(self):
@@ -661,6 +1015,7 @@ class CrossSectionWidget(pg.ImageView):
         self.view.addItem(self.v_line, ignoreBounds=False)
         self.x_cross_index = 0
         self.y_cross_index = 0
+        self.drawn_indices = (None, None)
         self.cross_section_enabled = True
         self.label = pg.LabelItem(justify="right")
         #self.cs_layout.addItem(self.label, 2, 1) #TODO: Find a way of displaying this label
@@ -668,6 +1023,7 @@ class CrossSectionWidget(pg.ImageView):
 
         ItemWidget.dock_area.addDock(self.h_cross_dock)
         ItemWidget.dock_area.addDock(self.v_cross_dock, position='right', relativeTo=self.h_cross_dock)
+        self.update_cross_section()
 
 
     def hide_cross_section(self):
@@ -698,12 +1054,12 @@ class CrossSectionWidget(pg.ImageView):
                 self.handle_mouse_move(mouse_event.scenePos())
 
     def handle_mouse_move(self, mouse_event):
-        if self.cross_section_enabled and self.search_mode:
+        if self.cross_section_enabled and self.search_mode and self.source is not None:
             view_coords = self.imageItem.getViewBox().mapSceneToView(mouse_event)
             view_x, view_y = view_coords.x(), view_coords.y()
-            item_coords = self.imageItem.mapFromScene(mouse_event)
-            item_x, item_y = item_coords.x(), item_coords.y()
-            max_x, max_y = self.imageItem.image.shape
+            item_x = (view_x - self._x0) / self._xscale
+            item_y = (view_y - self._y0) / self._yscale
+            max_x, max_y = self.source.shape
             if item_x < 0 or item_x > max_x or item_y < 0 or item_y > max_y:
                 return
             self.v_line.setPos(view_x)
@@ -711,21 +1067,45 @@ class CrossSectionWidget(pg.ImageView):
             #(min_view_x, max_view_x), (min_view_y, max_view_y) = self.imageItem.getViewBox().viewRange()
             self.x_cross_index = max(min(int(item_x), max_x-1), 0)
             self.y_cross_index = max(min(int(item_y), max_y-1), 0)
-            self.update_cross_section()
+            if not self.cross_section_timer.isActive():
+                self.cross_section_timer.start()
             self.label.setText("x=%.2e, y=%.2e" % (view_x, view_y))
 
+    def column(self, j):
+        """source[:, j], as a contiguous array"""
+        block = j // self.column_block
+        columns = self.column_blocks.pop(block, None)
+        if columns is None:
+            # A single strided read is cheaper than transposing, as for live images
+            self.column_reads[block] = self.column_reads.get(block, 0) + 1
+            if self.column_reads[block] < 2:
+                return np.ascontiguousarray(self.source[:, j])
+            start = block * self.column_block
+            columns = np.ascontiguousarray(self.source[:, start:start+self.column_block].T)
+        self.column_blocks[block] = columns
+        while len(self.column_blocks) > self.max_column_blocks:
+            self.column_blocks.popitem(last=False)
+        return columns[j % self.column_block]
+
     def update_cross_section(self):
-        nx, ny = self.imageItem.image.shape
+        if not self.cross_section_enabled or self.source is None:
+            return
+        nx, ny = self.source.shape
         x0, y0, xscale, yscale = self._x0, self._y0, self._xscale, self._yscale
-        xdata = np.linspace(x0, x0+(xscale*(nx-1)), nx)
-        ydata = np.linspace(y0, y0+(yscale*(ny-1)), ny)
-        zval = self.imageItem.image[self.x_cross_index, self.y_cross_index]
-        self.h_cross_section_widget_data.setData(xdata, self.imageItem.image[:, self.y_cross_index])
-        self.h_cross_section_widget.v_line.setPos(xdata[self.x_cross_index])
+        xdata = ItemWidget.axes.get(x0, xscale, nx)
+        ydata = ItemWidget.axes.get(y0, yscale, ny)
+        x_index, y_index = self.x_cross_index, self.y_cross_index
+        zval = self.source[x_index, y_index]
+        drawn_x, drawn_y = self.drawn_indices
+        if y_index != drawn_y:
+            self.h_cross_section_widget_data.setData(xdata, self.column(y_index))
+        self.h_cross_section_widget.v_line.setPos(xdata[x_index])
         self.h_cross_section_widget.h_line.setPos(zval)
-        self.v_cross_section_widget_data.setData(ydata, self.imageItem.image[self.x_cross_index, :])
-        self.v_cross_section_widget.v_line.setPos(ydata[self.y_cross_index])
+        if x_index != drawn_x:
+            self.v_cross_section_widget_data.setData(ydata, self.source[x_index, :])
+        self.v_cross_section_widget.v_line.setPos(ydata[y_index])
         self.v_cross_section_widget.h_line.setPos(zval)
+        self.drawn_indices = x_index, y_index
 
 def random_color(base=50):
     'A whitish random color. Adjust whiteness up by increasing base'
@@ -1,12 +1,23 @@
 import time
+import_start = time.time()
 import os
 from PyQt4 import Qt
 from widgets import *
+from buffers import GrowableArray, row_range, merge_ranges, shift_rows
+from shm import SharedArrayCache
+from direct import DirectFile, is_under
+from workers import WorkerPool
+from compression import decode_array, is_encoded
+from profiling import profiler
 import objectsharer as objsh
 import pickle
 import sys
 import logging
 import traceback
+import cProfile
+import pstats
+
+profiler.record('startup', 'import', time.time() - import_start)
 
 logger = logging.getLogger("Plot Window")
 logger.setLevel(logging.WARNING)
@@ -16,47 +27,52 @@ handler.setLevel(logging.WARNING)
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
-from dataserver import DATA_DIRECTORY
-h5file_directory = DATA_DIRECTORY
+h5file_directory = None # Set from the dataserver by data_directory
 h5file_filter = 'HDF5 Files (*.h5)'
 
 objsh.DEFAULT_TIMEOUT = 10000
 
 
+def data_directory():
+    """Where the dataserver keeps its files. It is only imported on first use, being slow to load"""
+    global h5file_directory
+    if h5file_directory is None:
+        from dataserver import DATA_DIRECTORY
+        h5file_directory = DATA_DIRECTORY
+    return h5file_directory
+
+
 class WindowItem(object):
     """
     An object with a presence in the data tree
     """
     registry = {}
+    data_tree_model = None
     data_tree_widget = None
-    attrs_widget_layout = None
+    attrs_editor = None
+    scheduler = None
+    populated = True # Whether the children are in the tree yet
     def __init__(self, name, parent=None, attrs=None):
         self.name = name
         self.parent = parent
         self.children = {}
-        if parent is not None:
-            parent.children[name] = self
+        self.child_list = [] # The children in tree order
+        self.row = None
         self.path = parent.path if parent is not None else ()
         self.path += (name,)
         self.strpath = '/'.join(self.path)
         assert self.path not in WindowItem.registry, self.strpath + " already exists"
         WindowItem.registry[self.path] = self
-        self.tree_item = DataTreeWidgetItem(self.path, [name, "", ""])
+        self.tree_text = [name, "", ""]
 
         if attrs is None:
             self.attrs = {}
         else:
             self.attrs = attrs
 
-        self.attrs_widget = NodeEditWidget(self.path, self.attrs)
-        self.attrs_widget.setVisible(False)
-        self.attrs_widget_layout.addWidget(self.attrs_widget)
-
-        if parent is None:
-            self.data_tree_widget.addTopLevelItem(self.tree_item)
-        else:
-            parent.tree_item.addChild(self.tree_item)
-        self.data_tree_widget.resizeColumnToContents(0)
+        if parent is not None:
+            parent.children[name] = self
+        self.data_tree_model.add_item(self)
 
     def root(self):
         if self.parent is None:
@@ -67,90 +83,278 @@ class WindowItem(object):
     def child_plots_visible(self):
         return any(c.child_plots_visible for c in self.children)
 
+    def is_leaf(self):
+        return self.populated and not self.child_list
+
     def update_tree_item(self, shape=None, visible=None):
         if shape is not None:
-            self.tree_item.setText(1, str(shape))
+            self.tree_text[1] = str(shape)
         if visible is not None:
-            self.tree_item.setText(2, str(visible))
+            self.tree_text[2] = str(visible)
+        with profiler.timed(self.strpath, 'tree'):
+            self.data_tree_model.item_changed(self)
+
+    def set_expanded(self, expanded):
+        self.data_tree_widget.setExpanded(self.data_tree_model.index_of(self), expanded)
+
+    def populate(self):
+        pass
 
     def check_expand_state(self):
+        if not self.populated:
+            return False
         for c in self.children.values():
             if isinstance(c, WindowPlot):
                 if c.plot and c.plot.is_visible():
-                    self.tree_item.setExpanded(False)
+                    self.set_expanded(False)
                     return True
             elif c.check_expand_state():
-                self.tree_item.setExpanded(False)
+                self.set_expanded(False)
                 return True
-        self.tree_item.setExpanded(True)
+        self.set_expanded(True)
         return False
 
     def update_attrs(self, attrs):
         self.attrs.update(attrs)
-        self.attrs_widget.update_attrs(attrs)
+        if self.attrs_editor is not None and self.attrs_editor.path == self.path:
+            self.attrs_editor.update_attrs(attrs)
+
+    def schedule_redraw(self, changed=None):
+        """
+        Ask for redraw(changed) to be called on the next frame. changed is the
+        (start, stop) range of rows modified, or None if it is unknown.
+        """
+        if self.scheduler is None:
+            self.redraw(changed)
+        else:
+            self.scheduler.schedule(self, changed)
+
+    def redraw(self, changed=None):
+        raise NotImplementedError
+
+    def catch_up(self):
+        """Bring a plot which went stale while hidden or paused up to date"""
+        self.schedule_redraw()
 
     def remove(self):
-        if self.parent is not None:
-            idx = self.tree_item.parent().indexOfChild(self.tree_item)
-            self.tree_item.parent().takeChild(idx)
-        else:
-            idx = self.data_tree_widget.indexOfTopLevelItem(self.tree_item)
-            self.data_tree_widget.takeTopLevelItem(idx)
-        del self.tree_item
-        del self.attrs_widget
+        if self.scheduler is not None:
+            self.scheduler.cancel(self)
+        if self.attrs_editor is not None and self.attrs_editor.path == self.path:
+            self.attrs_editor.clear()
+        self.data_tree_model.remove_item(self)
         del WindowItem.registry[self.path]
 
 
-class DataTreeWidgetItem(Qt.QTreeWidgetItem):
+class DataTreeModel(Qt.QAbstractItemModel):
     """
-    Subclass QTreeWidgetItem to give it a globally recognized identifier
+    Item model presenting the WindowItems as the data tree.
+
+    The WindowItems are the nodes themselves, so an item costs a row in its
+    parent's child_list rather than any widgets. Groups whose children have
+    not been added yet report that they have some, and are populated when
+    the view asks to fetch them on expansion.
     """
-    def __init__(self, path, *args, **kwargs):
-        Qt.QTreeWidgetItem.__init__(self, *args, **kwargs)
-        self.path = path
-        self.strpath = '/'.join(self.path)
+    headers = ['Name', 'Shape', 'Visible?']
 
-    def is_leaf(self):
-        return self.childCount() == 0
+    def __init__(self):
+        Qt.QAbstractItemModel.__init__(self)
+        self.top_level = []
+
+    def item(self, index):
+        """The WindowItem at index, or None for the root"""
+        return index.internalPointer() if index.isValid() else None
 
-    def get_children(self):
-        for i in range(self.childCount()):
-            yield self.child(i)
+    def index_of(self, item, column=0):
+        if item is None:
+            return Qt.QModelIndex()
+        return self.createIndex(item.row, column, item)
+
+    def children_of(self, item):
+        return self.top_level if item is None else item.child_list
+
+    def add_item(self, item):
+        siblings = self.children_of(item.parent)
+        row = len(siblings)
+        self.beginInsertRows(self.index_of(item.parent), row, row)
+        item.row = row
+        siblings.append(item)
+        self.endInsertRows()
+
+    def remove_item(self, item):
+        siblings = self.children_of(item.parent)
+        self.beginRemoveRows(self.index_of(item.parent), item.row, item.row)
+        del siblings[item.row]
+        for row in range(item.row, len(siblings)):
+            siblings[row].row = row
+        self.endRemoveRows()
+
+    def item_changed(self, item):
+        self.dataChanged.emit(self.index_of(item, 0), self.index_of(item, len(self.headers)-1))
+
+    def index(self, row, column, parent=Qt.QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return Qt.QModelIndex()
+        return self.createIndex(row, column, self.children_of(self.item(parent))[row])
+
+    def parent(self, index):
+        item = self.item(index)
+        if item is None or item.parent is None:
+            return Qt.QModelIndex()
+        return self.index_of(item.parent)
+
+    def rowCount(self, parent=Qt.QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self.children_of(self.item(parent)))
+
+    def columnCount(self, parent=Qt.QModelIndex()):
+        return len(self.headers)
+
+    def hasChildren(self, parent=Qt.QModelIndex()):
+        item = self.item(parent)
+        if item is not None and not item.populated:
+            return True
+        return self.rowCount(parent) > 0
+
+    def canFetchMore(self, parent):
+        item = self.item(parent)
+        return item is not None and not item.populated
+
+    def fetchMore(self, parent):
+        self.item(parent).populate()
+
+    def data(self, index, role=Qt.Qt.DisplayRole):
+        if not index.isValid() or role != Qt.Qt.DisplayRole:
+            return None
+        return self.item(index).tree_text[index.column()]
+
+    def headerData(self, section, orientation, role=Qt.Qt.DisplayRole):
+        if orientation == Qt.Qt.Horizontal and role == Qt.Qt.DisplayRole:
+            return self.headers[section]
+        return None
 
 
 class WindowDataGroup(WindowItem):
     """
     A Data Tree Item corresponding to a (remote) shared DataGroup
+
+    The subtree below a group is built from a describe_tree snapshot, so that
+    hydrating it costs one remote call where the dataserver supports it. The
+    proxies of datasets are only looked up, and their signals connected, once
+    something needs them.
+
+    Below the top level, children are only added to the tree when the group is
+    first expanded, and until then the group doesn't listen for changes either.
+    Its snapshot is reconciled with the current keys at that point.
+
+    With direct_read set, datasets in files under the data directory are read
+    from disk rather than through the dataserver, which is still relied on to
+    announce changes. A file which can't be opened is tried again after
+    direct_retry_interval seconds.
     """
-    def __init__(self, name, parent, proxy=None, **kwargs):
+    direct_read = False
+    direct_retry_interval = 10
+    filename = None # Path of the file, for top level groups, relative to the data directory if not absolute
+    direct = None # The DirectFile, for top level groups, once one is open
+    direct_retry_at = 0 # When next to try opening it
+    def __init__(self, name, parent, proxy=None, snapshot=None, **kwargs):
         super(WindowDataGroup, self).__init__(name, parent, **kwargs)
         logger.debug('Initializing WindowDataGroup %s' % self.strpath)
 
-        if proxy is None:
-            if parent is None:
-                raise ValueError("Top Level WindowDataGroups must be provided with a proxy")
-            self.proxy = parent.proxy[name]
-        else:
+        self._proxy = None
+        self.proxy_connected = False
+        if proxy is not None:
             self.proxy = proxy
-        self.attrs_widget.set_proxy(self.proxy)
+        elif parent is None:
+            raise ValueError("Top Level WindowDataGroups must be provided with a proxy")
 
-        self.attrs = self.proxy.get_attrs()
-        self.update_attrs(self.attrs)
+        if snapshot is None:
+            snapshot = describe_tree(self.proxy, depth=1)
+        self.update_attrs(snapshot['attrs'])
 
         if not self.is_dataset():
             self.children = {}
-            for name in self.proxy.keys():
-                self.update_child(name)
-
-            self.proxy.connect('changed', self.update_child)
-            self.proxy.connect('group-added', self.add_group)
+            self.populated = False
+            self.pending_children = snapshot['children']
+            # Files and empty groups are where new data shows up, so they listen straight away
+            if parent is None or self.pending_children == {}:
+                self.populate()
+
+    @property
+    def proxy(self):
+        if self._proxy is None:
+            self._proxy = self.parent.proxy[self.name]
+        if not self.proxy_connected:
+            self.proxy_connected = True
+            self.connect_proxy()
+        return self._proxy
+
+    @proxy.setter
+    def proxy(self, proxy):
+        self._proxy = proxy
+        self.proxy_connected = False
+
+    def connect_proxy(self):
+        if not self.is_dataset():
+            self._proxy.connect('changed', self.update_child)
+            self._proxy.connect('group-added', self.add_group)
             #TODO connect removed
-
-        self.proxy.connect('attrs-changed', self.update_attrs)
+        self._proxy.connect('attrs-changed', self.update_attrs)
 
     def is_dataset(self):
         return isinstance(self, WindowDataSet)
 
+    def direct_file(self):
+        """The DirectFile this file's datasets can be read from, or None"""
+        root = self.root()
+        if not root.direct_read or root.filename is None:
+            return None
+        if root.direct is None and time.time() >= root.direct_retry_at:
+            root.direct_retry_at = time.time() + self.direct_retry_interval
+            filename = os.path.join(data_directory(), root.filename)
+            if is_under(filename, data_directory()):
+                try:
+                    root.direct = DirectFile(filename)
+                except IOError:
+                    logger.warning('Could not open %s for direct reads' % filename)
+        return root.direct
+
+    def close_direct(self):
+        """Close the DirectFile of a top level group, if open, and forget any failure to open it"""
+        if self.direct is not None:
+            self.direct.close()
+        self.direct = None
+        self.direct_retry_at = 0
+
+    def populate(self, block=False):
+        """
+        Add the children to the tree, on first expansion. Unless block is set
+        they are listed asynchronously, and show up when the reply arrives.
+        """
+        if self.populated:
+            return
+        self.populated = True
+        children, self.pending_children = self.pending_children, None
+        if children is not None: # The snapshot may be out of date by now
+            request(self.proxy.keys, (), lambda keys: self.add_children(children, keys), block=block)
+        elif hasattr(self.proxy, 'describe_tree'):
+            request(self.proxy.describe_tree, (), lambda tree: self.add_children(tree['children']),
+                    block=block)
+        else:
+            self.add_children(describe_tree(self.proxy, depth=1)['children'])
+
+    def add_children(self, children, keys=None):
+        """Add the children named in keys, from their snapshots where there are any"""
+        if WindowItem.registry.get(self.path) is not self:
+            return # Removed while they were being listed
+        for key in (children.keys() if keys is None else keys):
+            if key in self.children:
+                continue # Added by a signal in the meantime
+            if key in children:
+                self.add_child(key, children[key])
+            else:
+                self.update_child(key)
+
     def update_child(self, key, slice=None):
         if key not in self.children:
             if hasattr(self.proxy[key], 'keys'):
@@ -161,6 +365,55 @@ class WindowDataGroup(WindowItem):
         if hasattr(self.children[key], 'update_data'): # Confusing to me...
             self.children[key].update_data(slice)
 
+    def resync(self, proxy=None, snapshot=None):
+        """
+        Bring the subtree up to date after a reconnect, from a describe_tree
+        snapshot, rather than rebuild it. Children which are gone are removed
+        and new ones added, while those still there are compared with what is
+        held and only updated where they differ. Groups not yet populated just
+        have their snapshot replaced.
+        """
+        snapshot = self.resync_node(proxy, snapshot)
+        if not self.populated:
+            self.pending_children = snapshot['children']
+            return
+        children = snapshot['children']
+        for key, child in self.children.items():
+            removed = WindowItem.registry.get(child.path) is not child
+            # A dataset may have been replaced by a group of the same name, or the other way round
+            if removed or key not in children or child.is_dataset() == ('children' in children[key]):
+                del self.children[key]
+                if not removed:
+                    child.remove()
+        for key, child_snapshot in children.items():
+            if key in self.children:
+                self.children[key].resync(child_snapshot.get('proxy'), child_snapshot)
+            else:
+                self.add_child(key, child_snapshot)
+
+    def resync_node(self, proxy, snapshot):
+        """
+        Take up proxy, or look the proxy up again from the parent's if None,
+        and bring the attrs up to date. Returns the snapshot of the node, which
+        is fetched if the one given stops short of children in the tree.
+        """
+        connected = self.proxy_connected
+        self.proxy = proxy
+        if connected:
+            self.proxy # Listen for changes again, on the new connection
+        if snapshot is None or (self.populated and snapshot.get('children', {}) is None):
+            snapshot = describe_tree(self.proxy, depth=1)
+        changed = changed_attrs(self.attrs, snapshot['attrs'])
+        if changed:
+            self.update_attrs(changed)
+        return snapshot
+
+    def add_child(self, key, snapshot):
+        if 'children' in snapshot:
+            return WindowDataGroup(key, self, proxy=snapshot.get('proxy'), snapshot=snapshot)
+        else:
+            return WindowDataSet(key, self, proxy=snapshot.get('proxy'), snapshot=snapshot)
+
     def add_group(self, key):
         path = self.path + (key,)
         if path in WindowItem.registry:
@@ -168,9 +421,7 @@ class WindowDataGroup(WindowItem):
             item.proxy = self.proxy[key]
             return
 
-        g = WindowDataGroup(key, self)
-        for key in g.proxy.keys():
-            g.update_child(key)
+        WindowDataGroup(key, self).populate()
 
     def add_dataset(self, key):
         return WindowDataSet(key, self)
@@ -179,22 +430,40 @@ class WindowDataGroup(WindowItem):
         if not self.is_dataset():
             for c in self.children.values():
                 c.remove()
+        self.close_direct()
         super(WindowDataGroup, self).remove()
 
 class WindowPlot(WindowItem):
     """
     A plot living in the Dock Area
+
+    Besides replacing the data with set_data, producers can stream into it
+    with append_data and set_data_slice, which only send and process the
+    new rows, and keep a rolling window of the latest rows with
+    set_rolling_window.
     """
     def __init__(self, name, parent, **kwargs):
         super(WindowPlot, self).__init__(name, parent, **kwargs)
         self.data = None
         self.rank = None
         self.plot = None
+        self.stale = False # Data changed while the plot was hidden
+        self.dependents = [] # Multiplots drawing this plot's data
+        self.shared = SharedArrayCache()
+        self.buffer = GrowableArray() # Holds the data while it is streamed into
+        self.streaming = False # Whether data is a view of the buffer
 
         objsh.register(self, self.strpath)
 
-    def set_data(self, data):
-        self.data = np.array(data)
+    def set_data(self, data, changed=None, n_bytes=None):
+        """
+        Show data, of which the (start, stop) rows changed, or all of them if
+        changed is None. n_bytes is how much of it came in with this update,
+        for the profiler, by default all of it.
+        """
+        start = time.time()
+        self.streaming = False
+        self.data = np.asarray(data)
         self.rank = self.get_rank()
 
         default_attrs = {
@@ -225,9 +494,88 @@ class WindowPlot(WindowItem):
             else:
                 raise Exception('No rank ' + str(self.rank) + ' item widget')
 
-        self.plot.update_plot(self.data, self.attrs)
         self.emit('data-changed')
+        for dependent in self.dependents:
+            dependent.update_source(self.path, changed)
+        self.schedule_redraw(changed)
+        profiler.record(self.strpath, 'set_data', time.time() - start,
+                        self.data.nbytes if n_bytes is None else n_bytes)
+
+    def set_shared_data(self, handle, changed=None):
+        """
+        set_data for a sender on the same host, with the array passed as the
+        handle of a shm.SharedArray. The rows in use are copied out of the
+        mapping straight away, as the sender goes on to write over it.
+        """
+        self.set_data(np.array(self.shared.resolve(handle)), changed)
+
+    def stream_buffer(self):
+        """The buffer, holding the current data, to stream into"""
+        if not self.streaming and self.data is not None:
+            self.buffer.set(self.data)
+        return self.buffer
+
+    def show_buffer(self, changed=None, n_bytes=None):
+        self.set_data(self.buffer.view(), changed, n_bytes)
+        self.streaming = True
+
+    def append_data(self, rows):
+        """
+        Append one row, or a stack of them, to the data. Only the new rows are
+        redrawn, unless the rolling window dropped old ones. As with
+        GrowableArray, the first rows of an image must come as a stack.
+        """
+        rows = np.asarray(rows)
+        buffer = self.stream_buffer()
+        n_rows, n_dropped = len(buffer), buffer.dropped
+        buffer.append(rows)
+        if buffer.dropped != n_dropped:
+            self.show_buffer(None, rows.nbytes) # Every row has moved
+        else:
+            self.show_buffer((n_rows, len(buffer)), rows.nbytes)
+
+    def set_data_slice(self, index, value):
+        """
+        data[index] = value, growing the data if the rows are past its end. If
+        that makes the rolling window drop rows, index is moved back with them.
+        """
+        value = np.asarray(value)
+        n_bytes = value.nbytes
+        buffer = self.stream_buffer()
+        n_rows, n_dropped = len(buffer), buffer.dropped
+        changed = row_range(index, n_rows)
+        if changed[1] > n_rows:
+            buffer.resize(changed[1])
+        if buffer.dropped != n_dropped:
+            index, value = shift_rows(index, value, buffer.dropped - n_dropped)
+            changed = None # Every row has moved
+        if index is not None:
+            buffer[index] = value
+        self.show_buffer(changed, n_bytes)
+
+    def set_rolling_window(self, n_rows=None):
+        """Keep only the latest n_rows rows of the data, or all of them if None"""
+        buffer = self.stream_buffer()
+        if len(buffer):
+            self.buffer = GrowableArray(buffer.view(), maxlen=n_rows)
+            self.show_buffer(n_bytes=0)
+        else:
+            self.buffer = GrowableArray(maxlen=n_rows)
+
+    def redraw(self, changed=None):
         self.update_tree_item(shape=self.data.shape, visible=self.plot.is_visible())
+        if not self.plot.is_live():
+            self.stale = True
+            return
+        self.stale = False
+        with profiler.timed(self.strpath, 'update_plot'):
+            self.plot.update_plot(self.data, self.attrs, changed)
+
+    def needs_data(self):
+        """Whether the plot, or a multiplot using it, is currently showing updates"""
+        if self.plot is not None and self.plot.is_live():
+            return True
+        return any(d.plot.is_live() for d in self.dependents)
 
     def set_attrs(self, attrs):
         self.attrs = attrs
@@ -269,61 +617,328 @@ class WindowMultiPlot(WindowItem):
             self.plot = MultiplotItemWidget(self)
             self.plot.line_plt.addLegend()
 
+        self.stale = False
+        self.changed_paths = {} # path -> rows changed since the last redraw
         for source in sources:
+            source.dependents.append(self)
             self.update_source(source.path)
-            source.connect('data-changed', lambda: self.update_source(source.path))
 
-    def update_source(self, path):
-        item = WindowItem.registry[path]
-        self.plot.update_path(path, item.data, item.attrs)
+    def update_source(self, path, changed=None):
+        """Note that the source at path changed, in the (start, stop) rows changed"""
+        if path in self.changed_paths:
+            changed = merge_ranges(self.changed_paths[path], changed)
+        self.changed_paths[path] = changed
+        self.schedule_redraw()
+
+    def catch_up(self):
+        for source in self.sources:
+            if source.stale:
+                source.catch_up()
+        self.schedule_redraw()
+
+    def redraw(self, changed=None):
+        if not self.plot.is_live():
+            self.stale = True
+            return
+        self.stale = False
+        while self.changed_paths:
+            path, changed = self.changed_paths.popitem()
+            item = WindowItem.registry[path]
+            if item.data is not None:
+                self.plot.update_path(path, item.data, item.attrs, changed)
 
 
 class WindowDataSet(WindowDataGroup, WindowPlot):
     load = True
+    append_sync = True
     """
     A WindowPlot which is kept in sync with a shared h5py DataSet
+
+    With append_sync enabled, growth announced by a 'resize' signal is fetched
+    incrementally: only rows past the locally held ones are requested from the
+    server and appended to a GrowableArray, whose valid region is what gets
+    plotted.
+
+    Reads are asynchronous. While one is in flight, further updates are merged
+    into a single refetch issued when it returns, so a busy dataset has at
+    most one request outstanding.
     :param name: TODO
     :param parent:
     :param proxy:
     :param attrs:
     """
-    def __init__(self, name, parent, load=None, **kwargs):
-        super(WindowDataSet, self).__init__(name, parent, **kwargs)
+    def __init__(self, name, parent, load=None, snapshot=None, **kwargs):
+        super(WindowDataSet, self).__init__(name, parent, snapshot=snapshot, **kwargs)
         logger.debug('Initializing WindowDataSet %s' % self.strpath)
         if load is not None:
             self.load = load
-        self.proxy.connect('resize', self.resize_data)
+        self.buffer = GrowableArray() # Local copy of the rows synced so far
+        self.remote_shape = None
+        self.full_sync_needed = True
+        self.fetching = False # Only one fetch is in flight at a time
+        self.refetch = False # Whether to fetch again when it's back
+        self.refetch_rows = None # The rows to fetch then, None for all of them
+        self.generation = 0 # Bumped on resync, so replies to fetches sent before it are ignored
+        if snapshot is not None and snapshot.get('shape') is not None:
+            self.update_tree_item(shape=tuple(snapshot['shape']))
         self.update_data()
 
+    def connect_proxy(self):
+        super(WindowDataSet, self).connect_proxy()
+        self._proxy.connect('resize', self.resize_data)
+
     def update_data(self, slice=None):
-        if self.load: # This is disabled on startup
+        if self.load and self.plot is not None and not self.needs_data():
+            self.defer_update(slice)
+        elif self.load and self.fetching:
+            self.queue_refetch(slice)
+        elif self.load: # This is disabled on startup
             logger.debug('Updating data at %s' % self.strpath)
-            print 'update', self.strpath
-            if self.data is None or slice is None:
-                self.data = self.proxy[:]
+            n_rows = len(self.buffer)
+            if self.full_sync_needed:
+                mode, index = 'all', np.s_[:]
+            elif slice is not None:
+                mode, index = 'slice', slice
+            elif self.append_sync and self.remote_shape[0] > n_rows:
+                mode, index = 'append', np.s_[n_rows:self.remote_shape[0]]
             else:
-                self.data[slice] = self.proxy[slice]
-            if len(self.data) > 0:
-                self.set_data(self.data)
+                mode, index = 'all', np.s_[:]
+            if mode == 'all':
+                direct = self.direct_file()
+                if direct is not None:
+                    direct.forget(self.path[1:])
+            self.fetching = True
+            generation = self.generation
+            self.fetch(index, lambda data: self.fetched(mode, index, data, generation))
+
+    def queue_refetch(self, slice):
+        """
+        Note an update arriving while a fetch is in flight. They are merged,
+        and fetched in one go when the reply comes in.
+        """
+        rows = None if slice is None else row_range(slice, len(self.buffer))
+        self.refetch_rows = merge_ranges(self.refetch_rows, rows) if self.refetch else rows
+        self.refetch = True
+
+    def fetched(self, mode, index, data, generation=None):
+        if generation is not None and generation != self.generation:
+            return # Sent before a resync, which has started over
+        self.fetching = False
+        if WindowItem.registry.get(self.path) is not self:
+            return # Removed while the fetch was in flight
+        changed = None
+        if mode != 'all' and self.full_sync_needed:
+            # The shape changed under the partial read, it can't be used
+            self.queue_refetch(None)
+            data = None
+        elif mode == 'all':
+            self.buffer.set(data)
+            self.remote_shape = self.buffer.shape
+            self.full_sync_needed = False
+        elif mode == 'slice':
+            n_rows = len(self.buffer)
+            changed = row_range(index, n_rows)
+            if changed[1] > n_rows:
+                self.buffer.resize(changed[1])
+            self.buffer[index] = data
+        else:
+            n_rows = len(self.buffer)
+            self.buffer.append(data)
+            changed = (n_rows, len(self.buffer))
+
+        if data is not None:
+            if len(self.buffer) > 0:
+                self.set_data(self.buffer.view(), changed, data.nbytes)
+            elif self.plot is None:
+                logger.warning('Dataset %s is empty' % self.strpath)
+        if self.refetch:
+            self.refetch = False
+            rows, self.refetch_rows = self.refetch_rows, None
+            self.update_data(None if rows is None else np.s_[rows[0]:rows[1]])
+
+    def fetch_failed(self, error):
+        logger.warning('Fetching %s failed: %s' % (self.strpath, error))
+        self.fetching = False
+        self.full_sync_needed = True
+
+    def defer_update(self, slice):
+        """
+        Note a change without fetching it. Appends are picked up by the usual
+        incremental fetch on catch up, anything else forces a full one.
+        """
+        self.stale = True
+        n_rows = len(self.buffer)
+        if slice is not None:
+            start, stop = row_range(slice, n_rows)
+            if start >= n_rows and self.remote_shape is not None:
+                self.remote_shape = (max(stop, self.remote_shape[0]),) + self.remote_shape[1:]
+            else:
+                self.full_sync_needed = True
+        elif self.remote_shape is None or self.remote_shape[0] <= n_rows:
+            self.full_sync_needed = True
+
+    def catch_up(self):
+        self.update_data()
+
+    def fetch(self, index, callback):
+        """
+        Read proxy[index] and hand it to callback, which is called from the
+        event loop once the reply arrives. Files read directly are read
+        straight away.
+        """
+        start = time.time()
+        def fetched(data):
+            data = np.asarray(data)
+            profiler.record(self.strpath, 'fetch', time.time() - start, data.nbytes)
+            callback(data)
+
+        direct = self.direct_file()
+        if direct is not None:
+            data = direct.read(self.path[1:], index)
+            if data is not None:
+                fetched(data)
+                return
+        request(self.proxy.__getitem__, (index,), fetched, errback=self.fetch_failed)
 
     def resize_data(self, new_shape):
-        if self.data is None:
-            self.update_data()
+        with profiler.timed(self.strpath, 'resize'):
+            if self.full_sync_needed:
+                self.update_data()
+                return
+            new_shape = tuple(new_shape)
+            self.remote_shape = new_shape
+            if new_shape[1:] != self.buffer.shape[1:]:
+                # Rows we already hold are missing their new columns
+                self.full_sync_needed = True
+            else:
+                self.buffer.reserve(new_shape[0])
+
+    def resync(self, proxy=None, snapshot=None):
+        """
+        Refetch after a reconnect, if the shape on the server differs from the
+        one held. Where the snapshot has no shape, the one last announced by
+        the server is assumed to still hold, and later changes are picked up
+        from its signals. Growth is fetched incrementally as usual, and fetches
+        still in flight from before are forgotten. Datasets which were never
+        loaded are left to be fetched when they are shown.
+        """
+        snapshot = self.resync_node(proxy, snapshot)
+        self.generation += 1
+        self.fetching = False
+        self.refetch = False
+        self.refetch_rows = None
+        shape = snapshot.get('shape')
+        if shape is not None:
+            shape = tuple(shape)
+            self.update_tree_item(shape=shape)
+        if self.remote_shape is None and self.plot is None:
+            return
+        if shape is None and not self.full_sync_needed:
+            shape = self.remote_shape # Rows announced but lost in the disconnect are still fetched
+        if shape is None or self.full_sync_needed:
+            self.full_sync_needed = True
+        elif shape == self.buffer.shape:
+            self.remote_shape = shape
             return
-        if new_shape[0] > self.data.shape[0]:
-            delta = list(self.data.shape)
-            delta[0] = new_shape[0] - self.data.shape[0]
-            self.data = np.concatenate((self.data, np.zeros(delta)))
-        if len(new_shape) > 1:
-            if new_shape[1] > self.data.shape[1]:
-                delta = list(self.data.shape)
-                delta[1] = new_shape[1] - self.data.shape[1]
-                self.data = np.hstack((self.data, np.zeros(delta)))
+        else:
+            self.resize_data(shape)
+        self.update_data()
 
     def update_attrs(self, attrs):
         super(WindowDataSet, self).update_attrs(attrs)
         if self.plot and any(key in self.plot.plot_attrs for key in attrs.keys()):
-            self.plot.update_plot(self.data, self.attrs)
+            self.schedule_redraw()
+
+
+class RedrawScheduler(object):
+    """
+    Coalesces redraws so that each item is drawn at most once per frame.
+
+    Items are scheduled along with the row range which changed, and ranges for
+    the same item are merged until the next tick of a single timer, when
+    item.redraw(changed) is called on everything pending. The timer only runs
+    while something is waiting to be drawn.
+    """
+    def __init__(self, max_fps=30):
+        self.pending = {}
+        self.timer = Qt.QTimer()
+        self.timer.timeout.connect(self.flush)
+        self.set_max_fps(max_fps)
+
+    def set_max_fps(self, fps):
+        self.max_fps = max(fps, 1)
+        self.timer.setInterval(int(1000. / self.max_fps))
+
+    def schedule(self, item, changed=None):
+        if item in self.pending:
+            changed = merge_ranges(self.pending[item], changed)
+        self.pending[item] = changed
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def cancel(self, item):
+        self.pending.pop(item, None)
+
+    def flush(self):
+        pending, self.pending = self.pending, {}
+        for item, changed in pending.items():
+            item.redraw(changed)
+        if not self.pending:
+            self.timer.stop()
+
+
+def request(function, args, callback, errback=None, block=False):
+    """
+    Call the proxied function(*args) and hand the result to callback. Unless
+    block is set the call doesn't wait for the reply, and callback is run from
+    the event loop when it arrives. Failures go to errback, or the log.
+    """
+    if block:
+        callback(function(*args))
+        return
+    def reply(result):
+        if isinstance(result, Exception):
+            if errback is not None:
+                errback(result)
+            else:
+                logger.warning('Remote call failed: %s' % result)
+        else:
+            callback(result)
+    function(*args, callback=reply)
+
+
+def changed_attrs(held, attrs):
+    """The entries of attrs which are missing from held, or differ from it"""
+    return dict((k, v) for k, v in attrs.items() if k not in held or not np.array_equal(held[k], v))
+
+
+def describe_tree(proxy, depth=None):
+    """
+    A snapshot of the node behind proxy and everything below it, as nested
+    dicts. Groups hold 'attrs' and 'children', a dict of snapshots by name.
+    Datasets hold 'attrs', and 'shape' and 'dtype' when the server knows them.
+
+    A dataserver exposing describe_tree() returns the whole thing in one call,
+    otherwise the hierarchy is walked node by node, and the proxies picked up
+    on the way are kept under 'proxy' so they need not be looked up again.
+    Datasets get their 'shape' where their proxies have one, as an attribute
+    or a method. The walk stops depth levels down, where groups get
+    'children' of None.
+    """
+    if hasattr(proxy, 'describe_tree'):
+        return proxy.describe_tree()
+    node = {'attrs': proxy.get_attrs(), 'proxy': proxy}
+    if hasattr(proxy, 'keys'):
+        if depth == 0:
+            node['children'] = None
+        else:
+            next_depth = None if depth is None else depth - 1
+            node['children'] = dict((key, describe_tree(proxy[key], next_depth)) for key in proxy.keys())
+    elif hasattr(proxy, 'shape'):
+        shape = proxy.shape() if callable(proxy.shape) else proxy.shape
+        if shape is not None:
+            node['shape'] = tuple(shape)
+    return node
 
 
 class WindowInterface:
@@ -342,6 +957,24 @@ class WindowInterface:
             return WindowItem.registry[(name,)]
         return WindowPlot(name, None)
 
+    def apply_batch(self, calls):
+        """
+        Apply the (name, method, args) plot calls queued by an
+        interface.BatchingClient, in order. Arrays in args may be encoded.
+        """
+        for name, method, args in calls:
+            if method not in ('set_data', 'append_data', 'set_data_slice', 'set_rolling_window'):
+                raise ValueError('Cannot batch ' + method)
+            args = [decode_array(a) if is_encoded(a) else a for a in args]
+            getattr(self.add_plot(name), method)(*args)
+
+    def get_profile(self):
+        """Timings of the window's hot paths, as profiling.Profiler.summary gives them"""
+        return profiler.summary()
+
+    def reset_profile(self):
+        profiler.reset()
+
     def quit(self):
         sys.exit()
 
@@ -349,12 +982,22 @@ class WindowInterface:
 class PlotWindow(Qt.QMainWindow):
     """
     A window for viewing and plotting DataSets and DataGroups shared by a DataServer
+
+    The connection is watched by a heartbeat which doesn't wait on its reply.
+    Once it is lost, reconnection is attempted with exponentially growing
+    delays, and on success the tree is resynced with what the server has now.
     """
+    heartbeat_interval = 5000 # ms
+    min_reconnect_delay = 1000 # ms
+    max_reconnect_delay = 60000 # ms
+    reconnect_timeout = 500 # ms, for looking up a server which may not be there
     def __init__(self):
         Qt.QMainWindow.__init__(self)
-        self.setup_ui()
+        with profiler.timed('startup', 'setup_ui'):
+            self.setup_ui()
         #self.data_groups = {}
-        self.setup_server()
+        with profiler.timed('startup', 'setup_server'):
+            self.setup_server()
 
     def setup_ui(self):
         # Sidebar / Dockarea
@@ -363,6 +1006,7 @@ class PlotWindow(Qt.QMainWindow):
         self.sidebar.setLayout(Qt.QVBoxLayout())
         self.dock_area = MyDockArea()
         ItemWidget.dock_area = self.dock_area
+        ItemWidget.workers = WorkerPool()
         self.centralWidget().addWidget(self.sidebar)
         self.centralWidget().addWidget(self.dock_area)
         self.centralWidget().setSizes([250, 1000])
@@ -377,21 +1021,35 @@ class PlotWindow(Qt.QMainWindow):
         max_plots_widget.layout().addWidget(self.max_plots_spinner)
         self.sidebar.layout().addWidget(max_plots_widget)
 
+        # Spinner limiting how often each plot is redrawn
+        WindowItem.scheduler = RedrawScheduler()
+        self.max_fps_spinner = Qt.QSpinBox()
+        self.max_fps_spinner.setRange(1, 120)
+        self.max_fps_spinner.setValue(WindowItem.scheduler.max_fps)
+        self.max_fps_spinner.valueChanged.connect(WindowItem.scheduler.set_max_fps)
+        max_fps_widget = Qt.QWidget()
+        max_fps_widget.setLayout(Qt.QHBoxLayout())
+        max_fps_widget.layout().addWidget(Qt.QLabel('Maximum Redraw Rate'))
+        max_fps_widget.layout().addWidget(self.max_fps_spinner)
+        self.sidebar.layout().addWidget(max_fps_widget)
+
         # Structure Tree
         sidebar_splitter = Qt.QSplitter(Qt.Qt.Vertical)
         self.sidebar.layout().addWidget(sidebar_splitter)
 
-        self.data_tree_widget = Qt.QTreeWidget()
-        self.data_tree_widget.setColumnCount(3)
-        self.data_tree_widget.setHeaderLabels(['Name', 'Shape', 'Visible?'])
-        self.data_tree_widget.itemSelectionChanged.connect(self.change_edit_widget)
-        self.data_tree_widget.itemDoubleClicked.connect(self.toggle_item)
-        self.data_tree_widget.itemSelectionChanged.connect(self.configure_tree_actions)
+        self.data_tree_model = DataTreeModel()
+        self.data_tree_widget = Qt.QTreeView()
+        self.data_tree_widget.setModel(self.data_tree_model)
+        self.data_tree_widget.selectionModel().selectionChanged.connect(lambda: self.change_edit_widget())
+        self.data_tree_widget.doubleClicked.connect(lambda index: self.toggle_item(self.data_tree_model.item(index)))
+        self.data_tree_widget.selectionModel().selectionChanged.connect(self.configure_tree_actions)
+        self.data_tree_widget.setSelectionBehavior(Qt.QAbstractItemView.SelectRows)
         self.data_tree_widget.setSelectionMode(Qt.QAbstractItemView.ExtendedSelection)
         self.data_tree_widget.setColumnWidth(0, 150)
         self.data_tree_widget.setColumnWidth(1, 50)
         self.data_tree_widget.setColumnWidth(2, 50)
         self.data_tree_widget.setColumnWidth(3, 50)
+        WindowItem.data_tree_model = self.data_tree_model
         WindowItem.data_tree_widget = self.data_tree_widget
         sidebar_splitter.addWidget(self.data_tree_widget)
 
@@ -425,16 +1083,19 @@ class PlotWindow(Qt.QMainWindow):
         self.data_tree_widget.addAction(self.rename_item_action)
 
         self.data_tree_widget.setContextMenuPolicy(Qt.Qt.ActionsContextMenu)
-        self.data_tree_widget.itemCollapsed.connect(lambda: self.data_tree_widget.resizeColumnToContents(0))
-        self.data_tree_widget.itemExpanded.connect(lambda: self.data_tree_widget.resizeColumnToContents(0))
+        self.data_tree_widget.collapsed.connect(lambda: self.data_tree_widget.resizeColumnToContents(0))
+        self.data_tree_widget.expanded.connect(lambda: self.data_tree_widget.resizeColumnToContents(0))
 
 
         # Attribute Editor Area
-        attrs_widget_box = Qt.QWidget()
-        attrs_widget_box.setLayout(Qt.QVBoxLayout())
-        WindowItem.attrs_widget_layout = attrs_widget_box.layout()
-        self.current_edit_widget = None
-        sidebar_splitter.addWidget(attrs_widget_box)
+        self.attrs_editor = NodeEditWidget()
+        WindowItem.attrs_editor = self.attrs_editor
+        sidebar_splitter.addWidget(self.attrs_editor)
+
+        # Profiling Panel
+        self.profiling_panel = ProfilingPanel()
+        self.profiling_panel.hide()
+        sidebar_splitter.addWidget(self.profiling_panel)
 
         # Status Bar
         self.connected_status = Qt.QLabel('Not Connected')
@@ -445,6 +1106,10 @@ class PlotWindow(Qt.QMainWindow):
 
         self.connection_checker = Qt.QTimer()
         self.connection_checker.timeout.connect(self.check_connection_status)
+        self.reconnect_timer = Qt.QTimer()
+        self.reconnect_timer.setSingleShot(True)
+        self.reconnect_timer.timeout.connect(self.try_reconnect)
+        self.reconnect_delay = self.min_reconnect_delay
 
         # Menu bar
         file_menu = self.menuBar().addMenu('File')
@@ -454,6 +1119,14 @@ class PlotWindow(Qt.QMainWindow):
         self.load_file_action = Qt.QAction('Load File', self)
         self.load_file_action.triggered.connect(lambda checked: self.load_file())
         file_menu.addAction(self.load_file_action)
+        self.direct_read_action = Qt.QAction('Read Local Files Directly', self)
+        self.direct_read_action.setCheckable(True)
+        self.direct_read_action.toggled.connect(self.set_direct_read)
+        file_menu.addAction(self.direct_read_action)
+        self.show_profile_action = Qt.QAction('Show Profiling', self)
+        self.show_profile_action.setCheckable(True)
+        self.show_profile_action.toggled.connect(self.profiling_panel.setVisible)
+        file_menu.addAction(self.show_profile_action)
 
     #######################
     # Data Server Actions #
@@ -462,12 +1135,21 @@ class PlotWindow(Qt.QMainWindow):
     def setup_server(self):
         self.zbe = objsh.ZMQBackend()
         self.zbe.start_server('127.0.0.1', 55563)
+        self.dataserver = None
+        self.connected = False
+        self.public_interface = WindowInterface(self)
+        self.zbe.add_qt_timer()
+        # Connecting may import the dataserver to find the data directory, which
+        # is slow, so it waits for the window to be up
+        Qt.QTimer.singleShot(0, self.connect_on_startup)
+
+    def connect_on_startup(self):
         try:
-            self.connect_dataserver()
+            with profiler.timed('startup', 'connect'):
+                self.connect_dataserver()
         except objsh.TimeoutError:
             logger.warning('Could not connect to dataserver on startup')
-        self.public_interface = WindowInterface(self)
-        self.zbe.add_qt_timer()
+            self.schedule_reconnect()
 
     def connect_dataserver(self):#, addr='127.0.0.1', port=55556):
         addr = '127.0.0.1'
@@ -475,40 +1157,126 @@ class PlotWindow(Qt.QMainWindow):
         self.zbe.refresh_connection('tcp://%s:%d' % (addr, port))
         self.dataserver = objsh.helper.find_object('dataserver', no_cache=True)
         self.dataserver.connect('file-added', self.add_file)
-        WindowDataSet.load = False
-        for filename, proxy in self.dataserver.list_files(names_only=False).items():
-            self.add_file(filename, proxy)
-        WindowDataSet.load = True
+        self.sync_files()
+        self.connected = True
         self.connected_status.setText('Connected to tcp://%s:%d' % (addr, port))
+        self.hello_pending = False
         self.connect_to_server_action.setEnabled(False)
         self.load_file_action.setEnabled(True)
-        self.connection_checker.start(5000)
+        self.reconnect_timer.stop()
+        self.reconnect_delay = self.min_reconnect_delay
+        self.connection_checker.start(self.heartbeat_interval)
+
+    def sync_files(self):
+        """
+        Show the files the dataserver has open. Those already in the tree, from
+        before a reconnect, are resynced rather than rebuilt, and those the
+        server no longer has are removed.
+        """
+        files = self.dataserver.list_files(names_only=False)
+        names = set(self.tree_name(filename) for filename in files)
+        for key, item in WindowItem.registry.items():
+            if len(key) == 1 and isinstance(item, WindowDataGroup) and key[0] not in names:
+                item.remove()
+        for filename, proxy in files.items():
+            group = WindowItem.registry.get((self.tree_name(filename),))
+            if isinstance(group, WindowDataGroup):
+                group.resync(proxy)
+            else:
+                self.add_file(filename, proxy)
+
+    def hello_received(self, result):
+        self.hello_pending = False
+
+    def set_direct_read(self, checked):
+        """Read datasets in files under the data directory from disk, not the dataserver"""
+        WindowDataGroup.direct_read = checked
+        for item in WindowItem.registry.values():
+            if isinstance(item, WindowDataGroup) and item.parent is None:
+                item.close_direct()
 
     def check_connection_status(self):
+        # The ping isn't waited on, no reply by the next check means we've lost the server
+        if not self.hello_pending:
+            self.hello_pending = True
+            try:
+                request(self.dataserver.hello, (), self.hello_received)
+            except Exception as e:
+                logger.warning('Could not ping the dataserver: %s' % e)
+                self.connection_lost()
+        else:
+            self.connection_lost()
+
+    def connection_lost(self):
+        self.hello_pending = False
+        self.connected = False
+        self.connection_checker.stop()
+        self.connect_to_server_action.setEnabled(True)
+        self.load_file_action.setEnabled(False)
+        self.reconnect_delay = self.min_reconnect_delay
+        self.schedule_reconnect()
+
+    def schedule_reconnect(self):
+        self.connected_status.setText('Not Connected, retrying in %d s' % (self.reconnect_delay // 1000))
+        self.reconnect_timer.start(self.reconnect_delay)
+
+    def try_reconnect(self):
+        """
+        Ping the server through the proxy we had, which gets an answer, if only
+        an error, once the server is back. Only then is the connection rebuilt,
+        as that blocks until the server replies. Without a proxy, as when the
+        server was down at startup, it is looked up, waiting at most
+        reconnect_timeout.
+        """
+        self.reconnect_delay = min(2 * self.reconnect_delay, self.max_reconnect_delay)
+        if self.dataserver is None:
+            timeout, objsh.DEFAULT_TIMEOUT = objsh.DEFAULT_TIMEOUT, self.reconnect_timeout
+            try:
+                self.connect_dataserver()
+            except objsh.TimeoutError:
+                self.schedule_reconnect()
+            finally:
+                objsh.DEFAULT_TIMEOUT = timeout
+            return
         try:
-            self.dataserver.hello(timeout=50)
+            request(self.dataserver.hello, (), self.server_answered, errback=self.server_answered)
+        except Exception as e:
+            logger.debug('Could not ping the dataserver: %s' % e)
+        self.schedule_reconnect()
+
+    def server_answered(self, result):
+        if self.connected:
+            return # A late reply to an earlier attempt
+        try:
+            self.connect_dataserver()
         except objsh.TimeoutError:
-            self.connected_status.setText('Not Connected')
-            self.connect_to_server_action.setEnabled(True)
-            self.load_file_action.setEnabled(False)
-            self.connection_checker.stop()
+            logger.warning('The dataserver answered, but could not be reconnected to')
+
+    def tree_name(self, filename):
+        """The name a file goes by in the tree, relative to the data directory if it's in there"""
+        if os.path.isabs(filename) and os.path.dirname(filename) == data_directory():
+            return os.path.basename(filename)
+        return filename
 
     def add_file(self, filename, proxy=None):
         if proxy is None:
             proxy = self.dataserver.get_file(filename)
-        if os.path.dirname(filename) == h5file_directory:
-            filename = os.path.basename(filename)
-        if (filename,) in WindowItem.registry:
-            WindowItem.registry[(filename,)].remove()
+        name = self.tree_name(filename)
+        if (name,) in WindowItem.registry:
+            WindowItem.registry[(name,)].remove()
         WindowDataSet.load = False
-        WindowDataGroup(filename, None, proxy)
+        group = WindowDataGroup(name, None, proxy)
+        group.filename = filename
         WindowDataSet.load = True
 
+    def selected_items(self):
+        """The WindowItems selected in the data tree"""
+        rows = self.data_tree_widget.selectionModel().selectedRows()
+        return [self.data_tree_model.item(index) for index in rows]
+
     def delete_item(self, item=None):
         if item is None:
-            item = self.data_tree_widget.selectedItems()[0]
-        if isinstance(item, DataTreeWidgetItem):
-            item = WindowItem.registry[item.path]
+            item = self.selected_items()[0]
         if item.parent is not None:
             del item.parent.proxy[item.name]
         else:
@@ -516,8 +1284,7 @@ class PlotWindow(Qt.QMainWindow):
         item.remove()
 
     def rename_item(self):
-        item = self.data_tree_widget.selectedItems()[0]
-        item = WindowItem.registry[item.path]
+        item = self.selected_items()[0]
         new_name, ok = Qt.QInputDialog.getText(self, "Renaming %s" % item.name, "New Name", Qt.QLineEdit.Normal, item.name)
         new_name = str(new_name)
         if ok and new_name and (new_name != item.name):
@@ -531,27 +1298,25 @@ class PlotWindow(Qt.QMainWindow):
     # Attribute Editor #
     ####################
 
-    def change_edit_widget(self, item=None, col=None):
+    def change_edit_widget(self, item=None):
         if item is None:
-            items = self.data_tree_widget.selectedItems()
+            items = self.selected_items()
             if not items:
+                self.attrs_editor.clear()
                 return
             item = items[0]
 
         logger.debug('Changing edit widget to %s' % item.strpath)
-        if self.current_edit_widget is not None:
-            self.current_edit_widget.hide()
-
-        widget = WindowItem.registry[item.path].attrs_widget
-        self.current_edit_widget = widget
-        widget.show()
+        # Attribute edits on groups and datasets go through to the server
+        proxy = item.proxy if isinstance(item, WindowDataGroup) else None
+        self.attrs_editor.bind(item.path, item.attrs, proxy)
 
     ################
     # File Buttons #
     ################
 
     def load_file(self):
-        filename = str(Qt.QFileDialog().getOpenFileName(self, 'Load HDF5 file', h5file_directory, h5file_filter))
+        filename = str(Qt.QFileDialog().getOpenFileName(self, 'Load HDF5 file', data_directory(), h5file_filter))
         if not filename:
             return
         self.dataserver.get_file(filename)
@@ -577,8 +1342,7 @@ class PlotWindow(Qt.QMainWindow):
 
     def add_multiplot(self, parametric=False, sourcepaths=None):
         if sourcepaths is None:
-            selection = self.data_tree_widget.selectedItems()
-            sources = [WindowItem.registry[i.path] for i in selection]
+            sources = self.selected_items()
         else:
             sources = [WindowItem.registry[path] for path in sourcepaths]
         WindowMultiPlot(sources, parametric)
@@ -597,42 +1361,40 @@ class PlotWindow(Qt.QMainWindow):
             widget.update_plot(path, leaf)
 
     def configure_tree_actions(self):
-        selection = self.data_tree_widget.selectedItems()
+        selection = self.selected_items()
         multiplot = len(selection) > 1
-        multiplot = multiplot and all(isinstance(WindowItem.registry[i.path], WindowDataSet) for i in selection)
-        multiplot = multiplot and all(WindowItem.registry[i.path].plot.rank == 1 for i in selection)
+        multiplot = multiplot and all(isinstance(i, WindowDataSet) for i in selection)
+        multiplot = multiplot and all(i.plot.rank == 1 for i in selection)
         parametric = multiplot and len(selection) == 2
         #if parametric:
         #    item1, item2 = [WindowItem.registry[i.path] for i in selection]
         #    parametric = parametric and item1.data.shape[0] == item2.data.shape[0]
         self.multiplot_action.setEnabled(multiplot)
         self.parametric_action.setEnabled(parametric)
-        is_file = all(i.parent() is None for i in selection)
-        is_group = all(i.parent() is not None for i in selection)
+        is_file = all(i.parent is None for i in selection)
+        is_group = all(i.parent is not None for i in selection)
         self.delete_item_action.setEnabled(len(selection) >= 1 and is_group)
         self.close_item_action.setEnabled(len(selection) >= 1 and is_file)
         self.rename_item_action.setEnabled(len(selection) == 1)
 
 
     def toggle_selection(self, show=None):
-        for item in self.data_tree_widget.selectedItems():
-            self.toggle_item(item, 0, show)
+        for item in self.selected_items():
+            self.toggle_item(item, show)
 
-    def toggle_item(self, item, col, show=None):
+    def toggle_item(self, item, show=None):
         if item.is_leaf():# and item.plot:
-            item = WindowItem.registry[item.path]
             if item.plot is None and isinstance(item, WindowDataSet):
                 item.load = True
-                item.update_data()
-                if item.plot is None:
-                    raise Exception("Dataset is empty")
+                item.update_data() # The plot is made when the data arrives
             else:
                 item.plot.toggle_hide(show=show)
-            item.update_tree_item(visible=item.plot.is_visible())
+                item.update_tree_item(visible=item.plot.is_visible())
         else:
-            for child in item.get_children():
-                self.toggle_item(child, col, show)
-            WindowItem.registry[item.path].check_expand_state()
+            item.populate(block=True)
+            for child in list(item.child_list):
+                self.toggle_item(child, show)
+            item.check_expand_state()
         Qt.QApplication.instance().processEvents()
 
 
@@ -669,16 +1431,45 @@ def excepthook(error, instance, tb):
     msg_box.exec_()
 
 
-def run_plotwindow():
+def report_startup(stats=None):
+    """
+    Print how long each step of startup took, first_event being the time from
+    the window module starting to import to the event loop running, after the
+    connection to the dataserver, and the slowest calls under stats if given.
+    """
+    profiler.record('startup', 'first_event', time.time() - import_start)
+    stages = profiler.summary().get('startup', {})
+    print 'Startup times:'
+    for stage in ('import', 'application', 'setup_ui', 'setup_server', 'show', 'connect', 'first_event'):
+        if stage in stages:
+            print '  %-14s %8.1f ms' % (stage, stages[stage]['max_ms'])
+    if stats is not None:
+        pstats.Stats(stats).sort_stats('cumulative').print_stats(25)
+
+
+def run_plotwindow(profile_startup=False):
+    """
+    Run the plot window. With profile_startup, the time taken by each step of
+    startup is printed once the event loop is running, along with the slowest
+    calls made while building the window.
+    """
     sys.excepthook = excepthook
-    app = Qt.QApplication([])
+    with profiler.timed('startup', 'application'):
+        app = Qt.QApplication([])
+    stats = cProfile.Profile() if profile_startup else None
+    if stats is not None:
+        stats.enable()
     win = PlotWindow()
-    win.show()
-    #win.showMaximized()
-    win.setMinimumSize(700, 500)
+    with profiler.timed('startup', 'show'):
+        win.show()
+        #win.showMaximized()
+        win.setMinimumSize(700, 500)
+    if stats is not None:
+        stats.disable()
+        Qt.QTimer.singleShot(0, lambda: report_startup(stats))
     app.connect(app, Qt.SIGNAL("lastWindowClosed()"), win, Qt.SIGNAL("lastWindowClosed()"))
     return app.exec_()
 
 
 if __name__ == "__main__":
-    sys.exit(run_plotwindow())
+    sys.exit(run_plotwindow(profile_startup='--profile-startup' in sys.argv))
@@ -0,0 +1,70 @@
+import threading
+import Queue
+import logging
+import traceback
+
+from PyQt4 import Qt
+
+logger = logging.getLogger("Workers")
+
+
+class WorkerPool(Qt.QObject):
+    """
+    Background threads for the number crunching half of plot updates.
+
+    Jobs are submitted under a key, normally the plot they draw. At most one
+    job per key is waiting at any time, a newer submission replacing the
+    waiting one, and jobs for the same key never overlap: the next is only
+    started once the callback for the previous one has run. The callback is
+    run on the GUI thread, through a queued signal.
+    """
+    n_threads = 2
+    finished = Qt.pyqtSignal(object, object, object)
+
+    def __init__(self, n_threads=None):
+        Qt.QObject.__init__(self)
+        self.lock = threading.Lock()
+        self.jobs = Queue.Queue()
+        self.waiting = {} # key -> (function, callback)
+        self.running = set()
+        self.finished.connect(self.deliver, Qt.Qt.QueuedConnection)
+        for _ in range(n_threads or self.n_threads):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, key, function, callback):
+        """Run function() in the background, then callback(result) on the GUI thread"""
+        with self.lock:
+            queued = key in self.waiting or key in self.running
+            self.waiting[key] = (function, callback)
+        if not queued:
+            self.jobs.put(key)
+
+    def is_busy(self, key):
+        with self.lock:
+            return key in self.waiting or key in self.running
+
+    def work(self):
+        while True:
+            key = self.jobs.get()
+            with self.lock:
+                function, callback = self.waiting.pop(key)
+                self.running.add(key)
+            try:
+                result = function()
+            except Exception:
+                logger.error('Background job failed\n' + traceback.format_exc())
+                result = None
+            self.finished.emit(key, callback, result)
+
+    def deliver(self, key, callback, result):
+        try:
+            if result is not None:
+                callback(result)
+        finally:
+            with self.lock:
+                self.running.discard(key)
+                requeue = key in self.waiting
+            if requeue:
+                self.jobs.put(key)